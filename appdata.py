@@ -0,0 +1,61 @@
+#Data of the Bokeh app (main.py) shared by all the sessions of a server process
+import threading
+from concurrent.futures import Future
+from os import path
+import astropy.units as u
+
+from stations import StationArray
+from skymap import SkyVisibility
+from sources import SourceTable, read_rfc_cat
+
+# Bokeh runs main.py again for each new session, but this module is only imported once
+# per server process, so the stations, the catalogue and the sky maps are loaded once.
+all_stations = StationArray.from_file(path.dirname(__file__)+'/station_location.txt')
+
+# Calibrators of the RfC catalogue (shown in the sky map), if it has been downloaded
+catalogue_file = path.dirname(__file__)+'/rfc_2021c_cat.txt'
+if path.isfile(catalogue_file):
+    calibrators = SourceTable.from_catalogue(read_rfc_cat(catalogue_file))
+    calibrators = calibrators.filter(calibrators.isCal)
+else:
+    calibrators = None
+
+# SkyVisibility of the whole sky (and the calibrators), keyed by (stations, epoch, duration).
+# They do not depend on the elevation limit, which only re-thresholds them. The values are
+# futures, so a sky is only computed once, and only the sessions that need it wait for it.
+sky_cache = {}
+max_cached_skies = 8
+# Spacing of the RA/Dec grid (deg)
+sky_step = 2.0
+# Only held to look up or insert the futures (never while a sky is computed)
+sky_lock = threading.Lock()
+
+
+def get_sky(station_codes, epoch, duration, times_obs):
+    """Returns the SkyVisibility for the given stations, epoch and duration (as typed in
+    the widgets), computed only if it is not in the cache (or being computed by another
+    session, which is then awaited).
+    """
+    key = (tuple(station_codes), epoch, duration)
+    future = sky_cache.get(key)
+    if future is None:
+        with sky_lock:
+            future = sky_cache.get(key)
+            is_new = future is None
+            if is_new:
+                if len(sky_cache) >= max_cached_skies:
+                    for a_key in [a_key for a_key, a_future in sky_cache.items() if a_future.done()]:
+                        del sky_cache[a_key]
+                future = sky_cache[key] = Future()
+
+        if is_new:
+            try:
+                future.set_result(SkyVisibility([all_stations[a_station] for a_station in station_codes],
+                                                times_obs, ra_step=sky_step*u.deg, dec_step=sky_step*u.deg,
+                                                sources=None if calibrators is None else calibrators.coord))
+            except Exception as error:
+                with sky_lock:
+                    del sky_cache[key]
+                future.set_exception(error)
+
+    return future.result()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+#Batch mode: selects fringe finders for many experiments (e.g. a whole EVN session) at once
+import argparse
+import csv
+import json
+import math
+import sys
+from os import path
+from concurrent.futures import ProcessPoolExecutor
+import astropy.units as u
+
+from stations import Station
+from util_functions import get_time, get_obs_times
+from sources import SourceTable, read_rfc_cat, get_top_sources, rfc_band
+
+# Catalogue and stations loaded once per worker process (see _init_worker)
+_catalogue = None
+_allStations = None
+
+
+def read_experiments(filename):
+    """Reads the experiments to process. The file can be a JSON list of objects or a CSV file
+    with a header, with the fields:
+    - name : name of the experiment
+    - start : start time ('DD/MM/YYYY HH:MM')
+    - duration : duration (hours)
+    - band : observing band (l, s, c, m, x, u, k, q). Defaults to c.
+    - stations : station codes (a list, or space-separated in CSV)
+    - min_el : minimum elevation (deg). Defaults to 20.
+    - min_flux : minimum unresolved flux (Jy). Defaults to 1.0.
+    - min_stations : minimum number of stations up at the same time. Defaults to all.
+    - rank : flux, common, window or snr. Defaults to flux.
+    - bandwidth : total bandwidth (MHz) for the expected fringe SNR. Defaults to 256.
+    - integration : fringe-fitting interval (s) for the expected fringe SNR. Defaults to 60.
+    Returns a list of dicts. Experiments with missing fields are reported by
+    select_fringe_finders.
+    """
+    with open(filename, 'rt') as fin:
+        if filename.endswith('.json'):
+            experiments = json.load(fin)
+        else:
+            experiments = [dict(row) for row in csv.DictReader(fin, skipinitialspace=True)]
+
+    for i, experiment in enumerate(experiments):
+        experiment.setdefault('name', 'experiment{}'.format(i))
+        experiment['stations'] = experiment.get('stations') or []
+        if isinstance(experiment['stations'], str):
+            experiment['stations'] = experiment['stations'].split()
+        experiment['duration'] = float(experiment['duration']) if experiment.get('duration') else None
+        experiment['band'] = experiment.get('band') or 'c'
+        experiment['min_el'] = float(experiment.get('min_el') or 20)
+        experiment['min_flux'] = float(experiment.get('min_flux') or 1.0)
+        experiment['min_stations'] = int(experiment['min_stations']) if experiment.get('min_stations') else None
+        experiment['rank'] = experiment.get('rank') or 'flux'
+        experiment['bandwidth'] = float(experiment.get('bandwidth') or 256)
+        experiment['integration'] = float(experiment.get('integration') or 60)
+
+    return experiments
+
+
+def _init_worker(catalogue, allStations):
+    global _catalogue, _allStations
+    _catalogue = catalogue
+    _allStations = allStations
+
+
+def select_fringe_finders(experiment, top=10):
+    """Returns the result (dict) for one experiment, with the top fringe finders. Errors in
+    the experiment (e.g. unknown station, missing field or unknown ranking) are reported in
+    the 'error' field, so they do not stop the other experiments.
+    """
+    result = {'name': experiment['name'], 'start': experiment.get('start'), 'duration': experiment['duration'],
+              'band': experiment['band'], 'stations': experiment['stations'], 'sources': []}
+    missing = [field for field in ('start', 'duration', 'stations') if not experiment.get(field)]
+    if len(missing) > 0:
+        result['error'] = "Missing {}".format(', '.join(missing))
+        return result
+
+    unknown = [station for station in experiment['stations'] if station.upper() not in _allStations]
+    if len(unknown) > 0:
+        result['error'] = "Unknown station {}".format(' '.join(unknown))
+        return result
+
+    try:
+        rfcBand = rfc_band(experiment['band'])
+        stations = [_allStations[station.upper()] for station in experiment['stations']]
+        obsTimes = get_obs_times(get_time(experiment['start']), experiment['duration'])
+        # The flux order of each band is computed once per worker and shared by all experiments
+        sources = get_top_sources(stations, _catalogue, obsTimes, top=top, minFluxBand=rfcBand,
+                                  minFlux=experiment['min_flux'], rankBy=experiment['rank'],
+                                  minEl=experiment['min_el'], minStations=experiment['min_stations'],
+                                  obsBand=experiment['band'], bandwidth=experiment['bandwidth']*u.MHz,
+                                  integration=experiment['integration']*u.s)
+    except ValueError as err:
+        result['error'] = str(err)
+        return result
+
+    for i, source in enumerate(sources):
+        result['sources'].append({'rank': i, 'name': source.name, 'ivsname': source.ivsname,
+                                  'ra': source.coord.ra.to_string(unit='hourangle', sep=':'),
+                                  'dec': source.coord.dec.to_string(sep=':'),
+                                  'resolved': source.flux[rfcBand].resolved,
+                                  'unresolved': source.flux[rfcBand].unresolved,
+                                  'commonFraction': round(float(sources.commonFraction[i]), 3),
+                                  'longestWindow': round(float(sources.longestWindow[i]), 3),
+                                  'fringeSNR': None if math.isnan(sources.fringeSNR[i])
+                                               else round(float(sources.fringeSNR[i]), 1)})
+    return result
+
+
+def run_batch(experiments, catalogueFile, stationsFile, top=10, workers=None):
+    """Processes all experiments in a process pool. The catalogue and the stations are loaded
+    only once and handed to each worker. Returns the list of results (in the same order).
+    """
+    catalogue = SourceTable.from_catalogue(read_rfc_cat(catalogueFile))
+    catalogue = catalogue.filter(catalogue.isCal)
+    allStations = Station.stations_from_file(stationsFile)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(catalogue, allStations)) as executor:
+        return list(executor.map(select_fringe_finders, experiments, [top]*len(experiments)))
+
+
+def write_results(results, filename):
+    """Writes the results as JSON (if filename ends with .json) or as CSV (one row per
+    experiment and source). A filename of '-' writes JSON to the standard output.
+    """
+    if filename == '-':
+        json.dump(results, sys.stdout, indent=2)
+        return
+
+    with open(filename, 'wt', newline='') as fout:
+        if filename.endswith('.json'):
+            json.dump(results, fout, indent=2)
+            return
+
+        fields = ['experiment', 'rank', 'name', 'ivsname', 'ra', 'dec', 'resolved', 'unresolved',
+                  'commonFraction', 'longestWindow', 'fringeSNR', 'error']
+        writer = csv.DictWriter(fout, fieldnames=fields)
+        writer.writeheader()
+        for result in results:
+            if 'error' in result:
+                writer.writerow({'experiment': result['name'], 'error': result['error']})
+            for source in result['sources']:
+                writer.writerow(dict(experiment=result['name'], **source))
+
+
+if __name__ == '__main__':
+    directory = path.dirname(path.realpath(__file__))
+    parser = argparse.ArgumentParser(description='Selects fringe finders for all the experiments in a file (non-interactive).\nBased on RfC catalogue.')
+    parser.add_argument('experiments', type=str, help="JSON or CSV file with the experiments (see read_experiments).")
+    parser.add_argument('-o', "--output", type=str, default='-', help="Output file (.json or .csv). Defaults to JSON in the standard output.")
+    parser.add_argument('-n', "--top", type=int, default=10, help="Number of fringe finders to report per experiment. Defaults to 10.")
+    parser.add_argument('-j', "--workers", type=int, default=None, help="Number of processes. Defaults to the number of cores.")
+    args = parser.parse_args()
+
+    results = run_batch(read_experiments(args.experiments), directory+"/rfc_2021c_cat.txt",
+                        directory+'/station_location.txt', args.top, args.workers)
+    write_results(results, args.output)
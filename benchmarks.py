@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+#Benchmarks of the catalogue loading, the visibility scans and the app updates
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import subprocess
+from os import path
+
+import numpy as np
+import astropy
+import astropy.coordinates as coord
+from astropy.utils import iers
+
+# Everything must run offline: use the bundled IERS-B table instead of downloading IERS-A
+iers.conf.auto_download = False
+iers.conf.auto_max_age = None
+
+from stations import Station
+from sources import load_rfc_cat, get_up_sources, get_top_sources
+from util_functions import get_time, get_obs_times
+
+directory = path.dirname(path.realpath(__file__))
+stationsFile = directory+'/station_location.txt'
+catalogueFile = directory+'/rfc_2021c_cat.txt'
+
+# Same arrays as in the app (main.py)
+evn = ['EF', 'MC', 'ON', 'TR', 'JB2', 'WB', 'NT', 'SH', 'YS', 'HH', 'UR', 'SV', 'ZC', 'BD', 'IR', 'MH', 'SR', 'KM']
+vlba = ['VLBA-BR', 'VLBA-FD', 'GBT', 'VLBA-HN', 'VLBA-KP', 'VLBA-LA', 'VLBA-MK', 'VLBA-NL', 'VLBA-OV', 'VLBA-PT',
+        'VLBA-SC', 'VLA']
+arrays = {'EVN': evn, 'VLBA': vlba, 'global': evn + vlba}
+durations = [4, 8, 12, 24]
+startTime = '10/04/2021 05:00'
+
+
+def timeit(function, repeat=5, warmup=1):
+    """Runs function warmup + repeat times and returns the timings (s) of the last repeat runs
+    as a dict with the 'min', 'median' and 'max' values.
+    """
+    for i in range(warmup):
+        function()
+
+    timings = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - t0)
+
+    return {'min': min(timings), 'median': float(np.median(timings)), 'max': max(timings)}
+
+
+def import_time(module='fringeSelect'):
+    """Returns the time (s) to import module in a new interpreter, from -X importtime."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import '+module], cwd=directory,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    for line in output.splitlines()[::-1]:
+        # "import time: self [us] | cumulative | imported package"
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])*1e-6
+
+    raise ValueError("{} not found in the -X importtime output".format(module))
+
+
+def app_update(repeat=5):
+    """Times update_data of the Bokeh app (main.py), from the change of a widget until the
+    plots are updated, for a new source (full recomputation) and for a new elevation limit
+    (cached elevations). If Bokeh is not installed (or does not work with the installed
+    numpy), both are reported as {'skipped': reason}.
+    """
+    try:
+        from bokeh.document import Document
+        from bokeh.application.handlers.script import ScriptHandler
+        from bokeh.models import Slider, TextInput
+    except (ImportError, AttributeError) as error:
+        print("Skipping the app benchmarks: {}".format(error), file=sys.stderr)
+        skipped = {'skipped': "Bokeh not usable: {}".format(error)}
+        return {'newSource': skipped, 'newLimit': skipped}
+
+    done = threading.Event()
+    doc = Document()
+
+    def next_tick(callback):
+        # No server: the result of the executor is applied right away
+        callback()
+        done.set()
+
+    doc.add_next_tick_callback = next_tick
+    handler = ScriptHandler(filename=directory+'/main.py')
+    handler.modify_document(doc)
+    if handler.failed:
+        raise RuntimeError(handler.error)
+
+    # The initial plots are computed in the background
+    if not done.wait(120):
+        raise RuntimeError("The app did not update")
+
+    widgets = {a_widget.title: a_widget for a_type in (Slider, TextInput) for a_widget in doc.select({'type': a_type})}
+    sourceInput = widgets['Source coordinates (hh:mm:ss dd:mm:ss)']
+    limitInput = widgets['Lowest elevation (degrees)']
+
+    def change(widget, value):
+        done.clear()
+        widget.value = value
+        if not done.wait(120):
+            raise RuntimeError("The app did not update")
+
+    results = {}
+    positions = iter(['{:02d}:29:06 {:02d}:03:08'.format(i % 24, i) for i in range(1, 1000)])
+    results['newSource'] = timeit(lambda: change(sourceInput, next(positions)), repeat)
+    limits = iter([5.0, 10.0]*repeat*2)
+    results['newLimit'] = timeit(lambda: change(limitInput, next(limits)), repeat)
+    return results
+
+
+def run_benchmarks(repeat=5, quick=False):
+    """Runs all benchmarks and returns the results (dict name: timings, or {'skipped': reason}
+    for the benchmarks that could not run).
+
+    The visibility scans are timed with the fast elevations for all durations, and with the
+    default path of fringeSelect (rise/set times refined with astropy) for one duration.
+    """
+    results = {}
+    results['import.fringeSelect'] = import_time('fringeSelect')
+    results['stations_from_file'] = timeit(lambda: Station.stations_from_file(stationsFile), repeat)
+    stationList = Station.stations_from_file(stationsFile)
+    results['load_rfc_cat.cached'] = timeit(lambda: load_rfc_cat(catalogueFile, 'c', 0.1), repeat)
+    results['load_rfc_cat.text'] = timeit(lambda: load_rfc_cat(catalogueFile, 'c', 0.1, useCache=False),
+                                          1 if quick else repeat)
+    catalogue = load_rfc_cat(catalogueFile, 'c', 0.1)
+
+    source = coord.SkyCoord('12h29m06.7s +02d03m08.6s')
+    obsTimes = get_obs_times(get_time(startTime), 12)
+    results['source_elevation'] = timeit(lambda: stationList['EF'].source_elevation(source, obsTimes), repeat)
+
+    for arrayName, codes in arrays.items():
+        stations = [stationList[code] for code in codes]
+        for duration in (durations[1:2] if quick else durations):
+            obsTimes = get_obs_times(get_time(startTime), duration)
+            name = '{}.{}h'.format(arrayName, duration)
+            results['get_up_sources.'+name] = timeit(lambda: get_up_sources(stations, catalogue, obsTimes,
+                                                     minFlux=0.1, fast=True), 1 if quick else repeat)
+            results['get_top_sources.'+name] = timeit(lambda: get_top_sources(stations, catalogue, obsTimes,
+                                                      minFlux=0.1, fast=True), 1 if quick else repeat)
+
+        obsTimes = get_obs_times(get_time(startTime), durations[1])
+        name = 'refined.{}.{}h'.format(arrayName, durations[1])
+        results['get_up_sources.'+name] = timeit(lambda: get_up_sources(stations, catalogue, obsTimes, minFlux=0.1),
+                                                 1 if quick else repeat)
+        results['get_top_sources.'+name] = timeit(lambda: get_top_sources(stations, catalogue, obsTimes,
+                                                  minFlux=0.1), 1 if quick else repeat)
+
+    for name, timings in app_update(1 if quick else repeat).items():
+        results['app.update_data.'+name] = timings
+
+    return results
+
+
+def best_time(timings):
+    """Returns the minimum time (s) of a result, or None if the benchmark was skipped."""
+    if isinstance(timings, dict):
+        return timings.get('min')
+    return timings
+
+
+def compare(results, previous, tolerance=0.2):
+    """Returns the benchmarks (list of (name, previous, current) in s) that are slower than
+    in the previous results by more than the tolerance (fraction), comparing the minimum times.
+    Benchmarks measured in the previous results but missing or skipped now are also returned
+    (with current None), so they are not taken as passed.
+    """
+    regressions = []
+    for name, timings in previous.items():
+        before = best_time(timings)
+        if before is None:
+            continue
+
+        current = best_time(results.get(name))
+        if (current is None) or (current > before*(1.0 + tolerance)):
+            regressions.append((name, before, current))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the benchmarks (offline) and stores the timings as JSON.')
+    parser.add_argument('-o', '--output', type=str, default=None, help="JSON file to write the results to.")
+    parser.add_argument('-c', '--compare', type=str, default=None, help="JSON file with previous results to compare with. The exit status is 1 if any benchmark is slower (or was not measured).")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2, help="Allowed slowdown (fraction) against the previous results. Defaults to 0.2.")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="Number of timed runs of each benchmark. Defaults to 5.")
+    parser.add_argument('--import-budget', type=float, default=1.0, help="Maximum import time of fringeSelect (s). Defaults to 1.0.")
+    parser.add_argument('--quick', default=False, action='store_true', help="Only one duration per array and one run of the slow benchmarks.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.quick)
+    for name, timings in results.items():
+        if best_time(timings) is None:
+            print("{:40} skipped ({})".format(name, timings['skipped']))
+        elif isinstance(timings, dict):
+            print("{:40} {:9.4f} s (median {:.4f} s)".format(name, timings['min'], timings['median']))
+        else:
+            print("{:40} {:9.4f} s".format(name, timings))
+
+    failed = False
+    if results['import.fringeSelect'] > args.import_budget:
+        print("Import time of fringeSelect ({:.2f} s) over the budget ({:.2f} s)".format(
+              results['import.fringeSelect'], args.import_budget))
+        failed = True
+
+    if args.output is not None:
+        with open(args.output, 'w') as outputFile:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__,
+                       'astropy': astropy.__version__, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'results': results}, outputFile, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as previousFile:
+            regressions = compare(results, json.load(previousFile)['results'], args.tolerance)
+
+        for name, before, current in regressions:
+            if current is None:
+                print("Not measured now: {} ({:.4f} s before)".format(name, before))
+            else:
+                print("Regression in {}: {:.4f} s -> {:.4f} s".format(name, before, current))
+
+        failed = failed or len(regressions) > 0
+
+    sys.exit(1 if failed else 0)
@@ -1,108 +1,139 @@
 #!/usr/bin/env python3
 import argparse
 import sys
-import numpy as np
-import math
-import webbrowser
-import requests
-from os import path,remove
+from os import path
 
-
-
-from stations import Station
+from stations import Station, declination_limits
 from util_functions import *
-from sources import Flux,Source,load_rfc_cat, get_up_sources
+from sources import Flux,Source,load_rfc_cat, get_up_sources, get_top_sources, rfc_band
+from scheduler import schedule_fringe_finders, slot_table
+from sidereal import SiderealElevationCache
+from resultcache import ResultCache
 
 
-def print_sources(sources):
-    print("{:>2} {:4} {:12} {:11} {:}".format('#', 'Cal?', 'Source name', 'Other name', 'Flux  Unresolved (at {}-band)'.format(rfcBand)))
+def print_sources(sources, rfcBand):
+    print("{:>2} {:4} {:12} {:11} {:28} {:7} {:10} {:}".format('#', 'Cal?', 'Source name', 'Other name', 'Flux  Unresolved (at {}-band)'.format(rfcBand), 'Common', 'Window (h)', 'Fringe SNR'))
 
     for i,source in enumerate(sources):
         if i > 9:
             break
-        print("{:2} {:4} {:12} {:11} {:3.2f}  {:3.2f}".format(i, 'Y' if source.isCal else 'N', source.name, source.ivsname, source.flux[rfcBand].resolved, source.flux[rfcBand].unresolved))
-
-
-
-#parse inputs
-parser = argparse.ArgumentParser(description='Provide some options for sources to use as fringe finders.\nBased on RfC catalogue.')
-parser.add_argument('timeStart', type=str, help="The start date/time of your experiment. Format ='DD/MM/YYYY HH:MM'")
-parser.add_argument('duration', type=float, help="The duration of your experiment (in hours)")
-parser.add_argument('-b', "--band", type=str, default='c', help="The band you are searching for, one of l, s, c, m, x, u, k, q.\nIf not specified will default to using C-band fluxes as priority.")
-parser.add_argument('-e', "--min-el", type=int, default=20, help="The minimum elevation to consider a source being 'up'. Defaults to 20.")
-parser.add_argument('-f', "--min-flux", type=float, default=1.0, help="The mimimum flux density of sources to consider. Defaults to 1.0 Jy")
-parser.add_argument('stations',type=str, nargs='+', help="Space delimited list of stations")
-
-args = parser.parse_args()
-
-directory = path.dirname(path.realpath(__file__))
-import wget
-#need to get rfc catalogue if we don't have it
-if not path.isfile(directory+"/rfc_2021c_cat.txt"):
-    print("RFC VLBI Source Position Catalogue not found, downloading.\nThis might take a moment...")
-    url = "http://astrogeo.org/vlbi/solutions/rfc_2021c/rfc_2021c_cat.txt"
-    wget.download(url, out=directory)
-    print("Done")
-
-#rfc only has fluxes for bands, s, c, u, and k so pick the closest band to requested.
-if args.band in ['l', 's']:
-    rfcBand = 's'
-elif args.band in ['c','m']:
-    rfcBand = 'c'
-elif args.band == 'x':
-    rfcBand = 'x'
-elif args.band == 'u':
-    rfcBand = 'u'
-elif args.band in ['k','q']:
-    rfcBand = 'k'
-else:
-    #not a known band?
-    print("Error band {} is unknown.".format(args.band))
-    sys.exit(2)
-
-
-#load station information for all stations.
-stationList = Station.stations_from_file(directory+'/station_location.txt')
-stations = [stationList[station.upper()] for station in args.stations]
-
-obsTimes = get_obs_times(get_time(args.timeStart), args.duration)
-
-sourceCat = load_rfc_cat(directory+"/rfc_2021c_cat.txt", rfcBand, args.min_flux)
-sources = get_up_sources(stations, sourceCat, obsTimes, minEl=args.min_el, minFluxBand=rfcBand)
-
-#ask which source to plot
-while True:
-    print()
-    print_sources(sources)
-    srcIndex = input("Please select the source to plot (0-9, q to quit): ")
-    if srcIndex == 'q':
-        break
-    try: srcIndex = int(srcIndex)
+        print("{:2} {:4} {:12} {:11} {:3.2f}  {:3.2f}{:18} {:5.0%}   {:4.1f}       {:6.1f}".format(i, 'Y' if source.isCal else 'N', source.name, source.ivsname, source.flux[rfcBand].resolved, source.flux[rfcBand].unresolved, '', sources.commonFraction[i], sources.longestWindow[i], sources.fringeSNR[i]))
+
+
+
+def main(argv=None):
+    #parse inputs
+    parser = argparse.ArgumentParser(description='Provide some options for sources to use as fringe finders.\nBased on RfC catalogue.')
+    parser.add_argument('timeStart', type=str, help="The start date/time of your experiment. Format ='DD/MM/YYYY HH:MM'")
+    parser.add_argument('duration', type=float, help="The duration of your experiment (in hours)")
+    parser.add_argument('-b', "--band", type=str, default='c', help="The band you are searching for, one of l, s, c, m, x, u, k, q.\nIf not specified will default to using C-band fluxes as priority.")
+    parser.add_argument('-e', "--min-el", type=int, default=20, help="The minimum elevation to consider a source being 'up'. Defaults to 20.")
+    parser.add_argument('-f', "--min-flux", type=float, default=1.0, help="The mimimum flux density of sources to consider. Defaults to 1.0 Jy")
+    parser.add_argument("--fast", action='store_true', help="Use the fast analytic elevations (accurate to a few arcsec) instead of the full astropy transformation.")
+    parser.add_argument("--lst-cache", type=str, default=None, help="File with a sidereal-time elevation cache to reuse (and update) across runs for different dates.")
+    parser.add_argument("--cache", action='store_true', help="Use (and update) the on-disk cache of elevations from previous runs. Faster for repeated queries, but the visibility is then sampled every 0.2 h instead of using the exact rise/set times.")
+    parser.add_argument("--clear-cache", action='store_true', help="Remove all the results stored in the on-disk cache before running.")
+    parser.add_argument("--min-stations", type=int, default=None, help="Minimum number of stations that must see the source at the same time. Defaults to all of them (at some point each).")
+    parser.add_argument("--min-common", type=float, default=0.0, help="Minimum fraction (0-1) of the experiment when the stations see the source at the same time. Defaults to 0.")
+    parser.add_argument("--rank", type=str, default='flux', choices=['flux', 'common', 'window', 'snr'], help="Rank the sources by flux, by fraction of common visibility, by the longest common-visibility window or by the expected fringe SNR on the worst baseline. Defaults to flux.")
+    parser.add_argument("--bandwidth", type=float, default=256, help="Total bandwidth of the experiment (MHz), used for the expected fringe SNR. Defaults to 256 MHz.")
+    parser.add_argument("--integration", type=float, default=60, help="Fringe-fitting solution interval (s), used for the expected fringe SNR. Defaults to 60 s.")
+    parser.add_argument("--min-sun", type=float, default=None, help="Minimum separation (deg) between the sources and the Sun. Defaults to no limit.")
+    parser.add_argument("--min-moon", type=float, default=None, help="Minimum separation (deg) between the sources and the Moon. Defaults to no limit.")
+    parser.add_argument("--schedule", type=float, default=None, help="Also propose one fringe-finder scan every SCHEDULE hours over the whole experiment, covering as many stations as possible.")
+    parser.add_argument("--scan-length", type=float, default=10, help="Length of the scheduled fringe-finder scans (min). Defaults to 10 min.")
+    parser.add_argument('stations',type=str, nargs='+', help="Space delimited list of stations")
+
+    args = parser.parse_args(argv)
+
+    directory = path.dirname(path.realpath(__file__))
+    #need to get rfc catalogue if we don't have it
+    if not path.isfile(directory+"/rfc_2021c_cat.txt"):
+        # Only needed (and imported) for the first run
+        import wget
+        print("RFC VLBI Source Position Catalogue not found, downloading.\nThis might take a moment...")
+        url = "http://astrogeo.org/vlbi/solutions/rfc_2021c/rfc_2021c_cat.txt"
+        wget.download(url, out=directory)
+        print("Done")
+
+    #rfc only has fluxes for bands, s, c, u, and k so pick the closest band to requested.
+    try:
+        rfcBand = rfc_band(args.band)
     except ValueError:
-        print("Must be an int (or q)!")
-        continue
-
-    if srcIndex in (list(range(10)) if len(sources) > 10 else list(range(len(sources)))):
+        #not a known band?
+        print("Error band {} is unknown.".format(args.band))
+        sys.exit(2)
+
+
+    #load station information for all stations.
+    stationList = Station.stations_from_file(directory+'/station_location.txt')
+    stations = [stationList[station.upper()] for station in args.stations]
+
+    obsTimes = get_obs_times(get_time(args.timeStart), args.duration)
+
+    #the scheduled fringe finders only need to be seen by two stations (by default)
+    minStations = (args.min_stations or 2) if args.schedule else args.min_stations
+    sourceCat = load_rfc_cat(directory+"/rfc_2021c_cat.txt", rfcBand, args.min_flux,
+                             decRange=declination_limits(stations, args.min_el*u.deg, min_stations=minStations))
+    if args.clear_cache:
+        ResultCache().clear()
+    if args.lst_cache:
+        elevationCache = SiderealElevationCache(filename=args.lst_cache)
+    elif args.cache:
+        elevationCache = ResultCache(catalogueKey=file_hash(directory+"/rfc_2021c_cat.txt"),
+                                     stationsKey=file_hash(directory+'/station_location.txt'), fast=args.fast)
+    else:
+        elevationCache = None
+    options = dict(minEl=args.min_el, minFluxBand=rfcBand, fast=args.fast, elevationCache=elevationCache,
+                   minCommon=args.min_common, obsBand=args.band, bandwidth=args.bandwidth*u.MHz,
+                   integration=args.integration*u.s,
+                   minSunSeparation=None if args.min_sun is None else args.min_sun*u.deg,
+                   minMoonSeparation=None if args.min_moon is None else args.min_moon*u.deg)
+    sources = get_top_sources(stations, sourceCat, obsTimes, top=10, minStations=args.min_stations,
+                              rankBy=args.rank, **options)
+    if args.schedule:
+        #fringe finders spread over the experiment, from all the sources seen by at least two stations
+        candidates = get_up_sources(stations, sourceCat, obsTimes, minStations=args.min_stations or 2, **options)
+        scans = schedule_fringe_finders(stations, candidates, obsTimes, spacing=args.schedule,
+                                        scanLength=args.scan_length/60., minFluxBand=rfcBand)
+        print()
+        print(slot_table(scans, [station.code for station in stations]))
+    if args.lst_cache:
+        elevationCache.save(args.lst_cache)
+
+    #ask which source to plot
+    while True:
+        print()
+        print_sources(sources, rfcBand)
+        srcIndex = input("Please select the source to plot (0-9, q to quit): ")
+        if srcIndex == 'q':
+            break
+        try: srcIndex = int(srcIndex)
+        except ValueError:
+            print("Must be an int (or q)!")
+            continue
 
-        print("Astrogeo calibrator link, has source maps, radplots:")
-        print(sources[srcIndex].get_astrogeo_link())
-        #webbrowser.open(sourceCoordString, new=0, autoraise=True)
+        if srcIndex in (list(range(10)) if len(sources) > 10 else list(range(len(sources)))):
 
-        links=sources[srcIndex].find_nmes()
-        if len(links) > 0:
-            print("The following NMEs have included this source:")
-            for a,b in zip(links[::2], links[1::2]):
-                print ("{:55} {:55}".format(a, b))
-        else:
-            print("No NME has included this source")
+            print("Astrogeo calibrator link, has source maps, radplots:")
+            print(sources[srcIndex].get_astrogeo_link())
 
+            links=sources[srcIndex].find_nmes()
+            if len(links) > 0:
+                print("The following NMEs have included this source:")
+                for a,b in zip(links[::2], links[1::2]):
+                    print ("{:55} {:55}".format(a, b))
+            else:
+                print("No NME has included this source")
 
 
-        #plot the elevations for the selected source
-        sources[srcIndex].plot_elevation(stations, obsTimes)
 
-    else:
-        print("Not in range")
+            #plot the elevations for the selected source
+            sources[srcIndex].plot_elevation(stations, obsTimes)
 
+        else:
+            print("Not in range")
 
 
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,14 @@
 
-from os import path
 import copy
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 from bokeh.io import curdoc
 from bokeh.layouts import row, column, widgetbox
-from bokeh.models import ColumnDataSource, HoverTool, Div
+from bokeh.models import ColumnDataSource, HoverTool, Div, LinearColorMapper, ColorBar
+from bokeh.palettes import Viridis256
 from bokeh.models.widgets import Slider, TextInput, Select, CheckboxGroup
 from bokeh.plotting import figure, show
 
@@ -14,11 +17,11 @@ from bokeh.embed import file_html
 
 from astropy import coordinates as coord
 from astropy import units as u
-from astropy.io import ascii
 
-from astroplan import Observer
-
-from stations import Station
+from visibility import rise_set_intervals
+from uvcoverage import uv_coverage
+from sunmoon import separation_mask
+from appdata import all_stations, calibrators, sky_step, get_sky
 
 from util_functions import *
 
@@ -45,16 +48,20 @@ type_array = Select(title="Type observation", value="EVN", options=observation_t
 source = TextInput(title="Source coordinates (hh:mm:ss dd:mm:ss)", value="00:00:00 00:00:00")
 epoch = TextInput(title="Starting UTC time (DD/MM/YYYY HH:MM)", value="01/01/2018 00:00")
 duration = Slider(title="Duration of the observation (hours)", value=8.0, start=1.0, end=30.0, step=0.25)
-elevation_limit = Slider(title="Lowest elevation (degrees)", value=10.0, start=0.0, end=50.0, step=5.0)
+# Lowest value of the elevation limit (deg), also used by the computations in the executor
+lowest_elevation_limit = 0.0
+elevation_limit = Slider(title="Lowest elevation (degrees)", value=10.0, start=lowest_elevation_limit, end=50.0,
+                         step=5.0)
+min_sun_separation = Slider(title="Minimum separation from the Sun (degrees)", value=0.0, start=0.0, end=90.0,
+                            step=5.0)
+min_moon_separation = Slider(title="Minimum separation from the Moon (degrees)", value=0.0, start=0.0, end=90.0,
+                             step=5.0)
 # Add checkboxes: include Ar, include eMERLIN, include VLBA, include LBA.
 outstations = CheckboxGroup(labels=["eMERLIN", "VLBA", "LBA", "KVN"], active=[])
 
 
 
 
-# Reading all stations
-all_stations = Station.stations_from_file(path.dirname(__file__)+'/station_location.txt')
-
 # Default parameters
 source_coord = coord.SkyCoord('00h00m00s +00d00m00s')
 times_obs = get_obs_times(get_time('01/01/2018 00:00'), duration.value)
@@ -64,84 +71,225 @@ selected_all_stations = stations['EVN'] + stations['eMERLIN'] + stations['VLBA']
 
 
 
-# Set up callbacks
-def update_data(attrname, old, new):
-    # get tge current slider values
-    # print(outstations.active)
-    # print(stations[type_array.value])
+def get_allowed(source_coord, times_obs, sun_limit, moon_limit):
+    """Returns if the source is far enough (deg, no limit if 0) from the Sun and the Moon at
+    each time (N_times).
+    """
+    return separation_mask(source_coord, times_obs, sun_limit*u.deg if sun_limit > 0.0 else None,
+                           moon_limit*u.deg if moon_limit > 0.0 else None)[0]
+
+
+def get_intervals_data(station_codes, source_coord, times_obs, min_elevation, allowed):
+    """Returns the data (segments) with the rise/set times of the source for all the given stations,
+    cut to the times when it is far enough from the Sun and the Moon (allowed, at each of times_obs).
+    """
+    station_codes = [a_station for a_station in station_codes
+                     if all_stations[a_station].max_elevation(source_coord.dec) >= min_elevation]
+    intervals_data = dict(x0=[], x1=[], station=[], code=[])
+    if len(station_codes) == 0:
+        return intervals_data
+
+    intervals = rise_set_intervals([all_stations[a_station] for a_station in station_codes], source_coord,
+                                   times_obs[0], times_obs[-1] - times_obs[0], min_elevation)
+    # Periods (first and last sample) when the source is far enough from the Sun and the Moon
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], allowed.astype(int), [0]])))
+    periods = [(times_obs[first].datetime, times_obs[last-1].datetime) for first, last in edges.reshape((-1, 2))]
+    for i, a_station in enumerate(station_codes):
+        for rise_time, set_time in intervals.times(0, i):
+            for period_start, period_end in periods:
+                x0, x1 = max(rise_time.datetime, period_start), min(set_time.datetime, period_end)
+                if x1 > x0:
+                    intervals_data['x0'].append(x0)
+                    intervals_data['x1'].append(x1)
+                    intervals_data['station'].append(all_stations[a_station].name)
+                    intervals_data['code'].append(a_station)
+
+    return intervals_data
+
+
+# Elevations (deg, as ndarray) already computed, keyed by (source, epoch, duration, station).
+elevations_cache = {}
+max_cached_elevations = 2000
+# What the ColumnDataSource of each station is showing: the params of get_request
+shown = {}
+
+
+def get_selected_stations():
     selected_stations = copy.deepcopy(stations[type_array.value])
     # Include outstations if there are some active
-    # print(selected_stations)
     for an_active in outstations.active:
-        # print(an_active)
         for a_new_station in stations[outstations.labels[an_active]]:
-            # print(a_new_station)
             selected_stations.append(a_new_station)
 
-    # print(outstations.active)
-    # print(selected_stations, '\n')
+    return selected_stations
+
+
+def get_elevations(params, station_codes, source_coord, times_obs):
+    """Returns a dict with the elevations (deg) of the source for the given stations, taken
+    from the cache if possible. The missing ones are computed all together in a single
+    transformation. The values do not depend on the elevation limit, so they are reused
+    when it changes. params is (source, epoch, duration) as typed in the widgets.
+    """
+    missing = [a_station for a_station in station_codes if params + (a_station,) not in elevations_cache]
+    if len(elevations_cache) + len(missing) > max_cached_elevations:
+        elevations_cache.clear()
+        missing = list(station_codes)
+
+    # Stations that can never see the source (given its declination) are skipped
+    visible = [a_station for a_station in missing
+               if all_stations[a_station].max_elevation(source_coord.dec) >= lowest_elevation_limit*u.deg]
+    if len(visible) > 0:
+        for a_station, ys in zip(visible, all_stations.source_elevation(source_coord, times_obs, visible).deg):
+            elevations_cache[params + (a_station,)] = ys
+
+    for a_station in missing:
+        if a_station not in visible:
+            elevations_cache[params + (a_station,)] = np.zeros(len(times_obs)) - 90.
+
+    return {a_station: elevations_cache[params + (a_station,)] for a_station in station_codes}
+
+
+def empty_station_data():
+    return dict(x=[], y=np.array([]), station=[], code=[])
+
+
+def get_request():
+    """Returns the current values of the widgets: ((source, epoch, duration, elevation limit,
+    Sun separation, Moon separation), stations).
+    """
+    return (source.value, epoch.value, duration.value, elevation_limit.value, min_sun_separation.value,
+            min_moon_separation.value), tuple(get_selected_stations())
+
+
+def compute_update(params, selected_stations):
+    """Does all the heavy computations for the given request. It runs in the executor, so
+    it must not touch the Bokeh models (or read the widgets).
+    """
+    times_obs = get_obs_times(get_time(params[1]), params[2])
+    source_coord = get_coordinates(params[0])
+    elevations = get_elevations(params[:3], selected_stations, source_coord, times_obs)
+    allowed = get_allowed(source_coord, times_obs, params[4], params[5])
+    intervals_data = get_intervals_data(selected_stations, source_coord, times_obs, params[3]*u.deg, allowed)
+    uv = uv_coverage([all_stations[a_station] for a_station in selected_stations], source_coord, times_obs,
+                     params[3]*u.deg)
+    for an_array in (uv.u, uv.v, uv.w):
+        an_array[:,~allowed] = np.nan
+    uu, vv = uv.points()
+    sky_hours, calibrator_hours = get_sky(selected_stations, params[1], params[2], times_obs).hours(*params[3:6])
+    return times_obs, elevations, allowed, intervals_data, dict(u=uu/1000., v=vv/1000.), sky_hours, \
+           calibrator_hours
+
+
+def apply_update(params, selected_stations, result):
+    """Updates the plots with the result of compute_update, sending only what changed:
+    nothing for the stations that did not change, a patch of the samples that changed
+    when only the elevation limit or the Sun/Moon separations changed, and the full data
+    only for new stations, sources or times.
+    """
+    times_obs, elevations, allowed, intervals_data, uv_data, sky_hours, calibrator_hours = result
+    for a_station in selected_all_stations:
+        if a_station not in selected_stations:
+            # Remove stations that are not anymore in the selected_stations
+            if shown.pop(a_station, None) is not None:
+                data[a_station].data = empty_station_data()
+            continue
+
+        if shown.get(a_station) == params:
+            continue
+
+        ys = elevations[a_station]
+        ys = np.where((ys >= params[3]) & allowed, ys, np.nan)
+        if shown.get(a_station, (None,))[:3] == params[:3]:
+            # Only the limits changed: patch the range of samples that changed
+            changed = np.nonzero(~np.isclose(data[a_station].data['y'], ys, equal_nan=True))[0]
+            if len(changed) > 0:
+                data[a_station].patch({'y': [(slice(changed[0], changed[-1]+1),
+                                              ys[changed[0]:changed[-1]+1])]})
+        else:
+            data[a_station].data = dict(x=times_obs.datetime, y=ys,
+                                        station=[all_stations[a_station].name]*len(ys),
+                                        code=[all_stations[a_station].code]*len(ys))
 
-    # ADD LBA VLBA, eMERLIN,...
-    times_obs = get_obs_times(get_time(epoch.value), duration.value)
-    source_coord = get_coordinates(source.value)
-    counter = 0
-    # keys_to_remove = []
-    # for a_key in data.keys():
-    #     if a_key not in selected_stations:
-    #         keys_to_remove.append(a_key)
-    #
-    # for a_key in keys_to_remove:
-    #     dev_null = data.pop(a_key, None)
+        shown[a_station] = params
 
-    # print(selected_stations)
+    data_intervals.data = intervals_data
+    data_uv.data = uv_data
+    data_sky.data = dict(image=[sky_hours])
+    sky_mapper.high = params[2]
+    if calibrators is not None:
+        # Only the hours change (the positions are sent once)
+        data_calibrators.data['hours'] = calibrator_hours
 
-    for a_station in selected_all_stations:
-        if a_station in selected_stations:
-            ys = all_stations[a_station].source_elevation(source_coord, times_obs)
-        else:
-            ys = (np.zeros_like(times_obs) - 90.)*u.deg
 
-        # ys = all_stations[a_station].source_elevation(source_coord, times_obs)
-        vs = np.zeros_like(ys) + counter*u.deg
-        condition = np.where(ys >= elevation_limit.value*u.deg)
-        data[a_station].data = dict(x=times_obs.datetime[condition], y=ys[condition],
-                        v=vs[condition], station=[all_stations[a_station].name]*len(ys[condition]),
-                        code=[all_stations[a_station].code]*len(ys[condition]))
-        # Remove stations that are not anymore in the selected_stations
+# The computations run in a background thread, so the server event loop (shared by all
+# sessions) never blocks. Only one request per session is computed at a time: requests
+# arriving meanwhile are coalesced into the latest one, and stale results are dropped.
+doc = curdoc()
+executor = ThreadPoolExecutor(max_workers=1)
+computing = {'request': None, 'pending': None}
+
+
+def start_update(request):
+    computing['request'] = request
+    future = executor.submit(compute_update, *request)
+    future.add_done_callback(lambda a_future: doc.add_next_tick_callback(partial(finish_update, request,
+                                                                                 a_future)))
+
 
-        counter -= 1
+def finish_update(request, future):
+    """Runs in the event loop once compute_update is done."""
+    pending, computing['request'], computing['pending'] = computing['pending'], None, None
+    if (pending is not None) and (pending != request):
+        # The widgets changed while computing: this result is stale
+        start_update(pending)
+        return
 
+    if future.exception() is not None:
+        # e.g. wrong coordinates or epoch in the widgets: the plots keep the previous request
+        logging.getLogger(__name__).error("Cannot update the plots for %s", request,
+                                          exc_info=future.exception())
+        return
 
+    apply_update(*request, future.result())
 
-for a_w in [type_array, epoch, duration, source, elevation_limit]:
+
+# Set up callbacks
+def update_data(attrname, old, new):
+    request = get_request()
+    if computing['request'] is not None:
+        computing['pending'] = request
+    else:
+        start_update(request)
+
+
+def close_session(session_context):
+    executor.shutdown(wait=False)
+
+
+for a_w in [type_array, epoch, duration, source, elevation_limit, min_sun_separation, min_moon_separation]:
     a_w.on_change('value', update_data)
 
 outstations.on_change('active', update_data)
+doc.on_session_destroyed(close_session)
 
 # Set up layout with widgets and add to document
-inputs = widgetbox(type_array, source, epoch, duration, elevation_limit, outstations)
+inputs = widgetbox(type_array, source, epoch, duration, elevation_limit, min_sun_separation, min_moon_separation,
+                   outstations)
 
 
 
 
-data = {}
-counter = 0
-# for a_station in selected_stations:
-for a_station in selected_all_stations:
-    if a_station in selected_stations:
-        ys = all_stations[a_station].source_elevation(source_coord, times_obs)
-    else:
-        ys = np.array([])
-    # source is visible?
-    # vs_cond = all_stations[a_station].is_source_visible(source_coord, times_obs, elevation_limit.value)
-    vs = np.zeros_like(ys) + counter*u.deg
-    condition = np.where(ys >= elevation_limit.value*u.deg)
-    data[a_station] = ColumnDataSource(data=dict(x=times_obs.datetime[condition], y=ys[condition],
-                        v=vs[condition], station=[all_stations[a_station].name]*len(ys[condition]),
-                        code=[all_stations[a_station].code]*len(ys[condition])))
-    # data[a_station] = ColumnDataSource(data=dict(x=times_obs.datetime, y=ys, #v=vs,
-    #                     station=[all_stations[a_station].name]*len(ys)))
-    counter -= 1
+# One ColumnDataSource per station. Elevations below the limit are NaN (not drawn).
+data = {a_station: ColumnDataSource(data=empty_station_data()) for a_station in selected_all_stations}
+data_intervals = ColumnDataSource(data=dict(x0=[], x1=[], station=[], code=[]))
+data_uv = ColumnDataSource(data=dict(u=[], v=[]))
+data_sky = ColumnDataSource(data=dict(image=[]))
+data_calibrators = ColumnDataSource(data=dict(ra=[], dec=[], name=[], hours=[]) if calibrators is None else
+                                    dict(ra=np.degrees(calibrators.ra), dec=np.degrees(calibrators.dec),
+                                         name=calibrators.name, hours=np.zeros(len(calibrators))))
+sky_mapper = LinearColorMapper(palette=Viridis256, low=0.0, high=duration.value)
+# The initial plots are also computed in the executor, so a new session never blocks the server
+start_update(get_request())
 
 
 hover = HoverTool(tooltips=[("Station", "@station"), ("Elevation (deg)", "@y")])
@@ -162,13 +310,15 @@ plot1.xgrid.visible = False
 plot1.ygrid.visible = False
 
 
-# Second plot: visibility versus time per station
+# Second plot: visibility versus time per station (from the exact rise/set times)
+hover_intervals = HoverTool(tooltips=[("Station", "@station"), ("Rise", "@x0{%F %H:%M}"),
+                                      ("Set", "@x1{%F %H:%M}")],
+                            formatters={'@x0': 'datetime', '@x1': 'datetime'})
 plot2 = figure(plot_height=int(800*golden_ratio), plot_width=800, title='Source visibility',
-            x_axis_type="datetime", tools=[hover, "crosshair,pan,reset,wheel_zoom,save"], 
+            x_axis_type="datetime", tools=[hover_intervals, "crosshair,pan,reset,wheel_zoom,save"],
             y_range=selected_all_stations[::-1])
 
-for a_station in selected_all_stations:
-    plot2.line(x='x', y='code', source=data[a_station], line_width=3, line_alpha=0.6)
+plot2.segment(x0='x0', y0='code', x1='x1', y1='code', source=data_intervals, line_width=3, line_alpha=0.6)
 
 plot2.xaxis.axis_label = "Time"
 plot2.yaxis.axis_label = "Stations"
@@ -179,14 +329,36 @@ plot2.ygrid.visible = True
 
 
 ############## UV-plot
-def get_uv_coordinates():
-    pass
+plot3 = figure(plot_height=int(800*golden_ratio), plot_width=int(800*golden_ratio), title='uv-coverage',
+               match_aspect=True, tools="crosshair,pan,reset,wheel_zoom,save")
+
+plot3.circle(x='u', y='v', source=data_uv, size=2, alpha=0.4)
+
+plot3.xaxis.axis_label = "u (km)"
+plot3.yaxis.axis_label = "v (km)"
+
+
+
+
+############## Sky map: hours of common visibility for all the selected stations
+hover_sky = HoverTool(tooltips=[("Source", "@name"), ("Common visibility (h)", "@hours{0.0}")])
+plot4 = figure(plot_height=int(800*golden_ratio), plot_width=800, title='Common visibility of the sky',
+               x_range=(360, 0), y_range=(-90, 90), tools=[hover_sky, "crosshair,pan,reset,wheel_zoom,save"])
+
+plot4.image(image='image', source=data_sky, x=-sky_step/2, y=-90-sky_step/2, dw=360, dh=180+sky_step,
+            color_mapper=sky_mapper)
+calibrator_renderer = plot4.circle(x='ra', y='dec', source=data_calibrators, size=3, line_color='white',
+                                   line_width=0.5, fill_color={'field': 'hours', 'transform': sky_mapper})
+hover_sky.renderers = [calibrator_renderer]
+plot4.add_layout(ColorBar(color_mapper=sky_mapper, title='Hours'), 'right')
 
+plot4.xaxis.axis_label = "RA (degrees)"
+plot4.yaxis.axis_label = "Dec (degrees)"
 
 
 
 
-curdoc().add_root(row(inputs, column(plot1, plot2)))
+curdoc().add_root(row(inputs, column(plot1, plot2), column(plot3, plot4)))
 # curdoc().add_root(row(inputs, plot1))
 curdoc().title = "My Observation"
 
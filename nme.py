@@ -0,0 +1,136 @@
+#Index of the NMEs (Network Monitoring Experiments) of the EVN that included each source
+import re
+import json
+import time
+from os import path
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from urllib.error import URLError
+
+from util_functions import cache_dir
+
+NME_INDEX_URL = "http://old.evlbi.org/tog/ftp_fringes/ftp.html"
+
+# Words in the NME pages that can be source names (J2000, IVS or common names like 3C345
+# or 4C39.25). Only words with at least one digit are kept in the index, without the
+# trailing punctuation (e.g. the period of a sentence or a list).
+_WORD = re.compile(r"[A-Za-z0-9+\-.]+")
+
+
+class NMEIndex:
+    """Inverted index from source names (J2000 and IVS) to the NME pages that include them.
+
+    The pages listed in the FTP-fringes index page are downloaded concurrently (with a
+    bounded thread pool), and the index is stored on disk as JSON. It is rebuilt when
+    it is older than ttl seconds, so lookups only read a dict.
+    """
+    def __init__(self, filename=None, indexUrl=NME_INDEX_URL, ttl=7*24*3600, maxWorkers=8, timeout=30):
+        """Inputs
+        ------
+        - filename : str
+            JSON file where the index is kept. Defaults to nme_index.json in the cache directory.
+        - indexUrl : str
+            Page listing the NMEs (any URL supported by urlopen, including file://).
+        - ttl : float
+            Age (in seconds) after which the index is refreshed.
+        - maxWorkers : int
+            Maximum number of pages downloaded at the same time.
+        - timeout : float
+            Timeout (in seconds) of each download.
+        """
+        self.filename = filename if filename is not None else path.join(cache_dir(), 'nme_index.json')
+        self.indexUrl = indexUrl
+        self.ttl = ttl
+        self.maxWorkers = maxWorkers
+        self.timeout = timeout
+        self.created = None
+        self.pages = []
+        self.index = {}
+        self.load()
+
+    def load(self):
+        """Loads the index from disk (if it exists and it was built from the same indexUrl)."""
+        try:
+            with open(self.filename, 'rt') as fin:
+                stored = json.load(fin)
+        except (OSError, ValueError):
+            return
+
+        if stored.get('indexUrl') == self.indexUrl:
+            self.created, self.pages, self.index = stored['created'], stored['pages'], stored['index']
+
+    def save(self):
+        with open(self.filename, 'wt') as fout:
+            json.dump({'indexUrl': self.indexUrl, 'created': self.created, 'pages': self.pages,
+                       'index': self.index}, fout)
+
+    def is_stale(self):
+        return (self.created is None) or (time.time() - self.created > self.ttl)
+
+    def _read(self, url):
+        from urllib.request import urlopen
+        with urlopen(url, timeout=self.timeout) as page:
+            return page.read().decode('utf-8', errors='replace')
+
+    def _read_or_none(self, url):
+        try:
+            return self._read(url)
+        except (URLError, OSError):
+            return None
+
+    def refresh(self):
+        """Downloads the list of NMEs and all their pages, and rebuilds the index."""
+        # Only needed (and slow to import) when the index is rebuilt
+        from bs4 import BeautifulSoup as bs
+        bsFtpPage = bs(self._read(self.indexUrl), features="html5lib")
+        pages = []
+        for link in bsFtpPage.findAll('a'):
+            href = link.get('href')
+            if (href is not None) and ("ftp_fringes" in href):
+                url = urljoin(self.indexUrl, href)
+                if url not in pages:
+                    pages.append(url)
+
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            texts = list(executor.map(self._read_or_none, pages))
+
+        index = {}
+        for i, text in enumerate(texts):
+            if text is None:
+                continue
+            for word in set(a_word.rstrip('.+-') for a_word in _WORD.findall(text)):
+                if any(c.isdigit() for c in word):
+                    index.setdefault(word, []).append(i)
+
+        self.created, self.pages, self.index = time.time(), pages, index
+        try:
+            self.save()
+        except OSError:
+            pass
+
+    def find(self, *names):
+        """Returns the links to the NMEs that included any of the given source names.
+        The index is refreshed first if it is stale (if that fails, e.g. when offline,
+        the stale index is used if there is one).
+        """
+        if self.is_stale():
+            try:
+                self.refresh()
+            except (URLError, OSError):
+                if self.created is None:
+                    raise
+
+        found = set()
+        for name in names:
+            found.update(self.index.get(name, []))
+        return [self.pages[i] for i in sorted(found)]
+
+
+_defaultIndex = None
+
+def default_index():
+    """Returns the NMEIndex shared by all sources (created on first use)."""
+    global _defaultIndex
+    if _defaultIndex is None:
+        _defaultIndex = NMEIndex()
+    return _defaultIndex
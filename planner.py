@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#Long-range planner: best start times of an experiment over a range of dates
+import argparse
+from os import path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import astropy.units as u
+import astropy.coordinates as coord
+
+from stations import Station, fast_elevations, earth_rotation_angle, declination_limits
+from sources import load_rfc_cat, rfc_band
+from visibility import longest_run
+from sidereal import SIDEREAL_DAY
+from util_functions import get_time, get_coordinates
+
+# Common-visibility arrays (N_sources, N_times) used by the worker processes (see _init_worker)
+_common = None
+_window = None
+_interval = None
+
+
+def _init_worker(common, window, interval):
+    global _common, _window, _interval
+    _common, _window, _interval = common, window, interval
+
+
+def _bin_metrics(bins):
+    """Returns the fraction of time and the longest window (hours) of common visibility of
+    every source for the observations starting at the given bins, with shape (N_sources, N_bins).
+    """
+    windows = _common[:, bins[:,np.newaxis] + np.arange(_window)[np.newaxis,:]]
+    return np.mean(windows, axis=2), np.maximum(longest_run(windows) - 1, 0)*_interval
+
+
+def sidereal_metrics(stations, coords, duration, epoch, minEl=20, minStations=None, interval=0.2, workers=None,
+                     chunkSize=24):
+    """Returns the common visibility of the sources for observations starting at every
+    bin of one sidereal day (bins of about interval hours, see sidereal_bins). As the
+    elevations repeat with the local sidereal time, these values hold for any date around
+    epoch (the apparent positions of the sources are taken at epoch; they only drift by
+    ~1 arcmin per year).
+
+    The elevations (stations.fast_elevations) are computed once for one sidereal day plus
+    the duration, and the metrics of each start bin are computed in chunks of chunkSize
+    bins in a process pool.
+
+    Inputs
+    ------
+    - stations : list of Station
+    - coords : astropy.coordinates.SkyCoord
+        Coordinates of the sources.
+    - duration : float
+        Duration of the observation (hours).
+    - epoch : astropy.time.Time
+        Reference time. Bin 0 starts at epoch.
+    - minEl : float
+        Elevation limit (deg).
+    - minStations : int
+        Minimum number of stations that must see a source at the same time (all if None).
+    - interval : float
+        Time resolution (hours) of the start times and of the visibility.
+    - workers : int
+        Number of processes. Defaults to the number of cores.
+
+    Outputs
+    -------
+    - fraction, longest : ndarray
+        Fraction of the observation and longest window (hours) with common visibility,
+        with shape (N_sources, N_bins).
+    """
+    nBins, interval = sidereal_bins(interval)
+    window = int(round(duration/interval)) + 1
+    obsTimes = epoch + np.arange(nBins + window)*interval*u.h
+    isUp = fast_elevations(stations, coords, obsTimes) >= minEl*u.deg
+    common = np.sum(isUp, axis=1) >= (len(stations) if minStations is None else minStations)
+    chunks = [np.arange(start, min(start + chunkSize, nBins)) for start in range(0, nBins, chunkSize)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(common, window, interval)) as executor:
+        results = list(executor.map(_bin_metrics, chunks))
+
+    return np.concatenate([r[0] for r in results], axis=1), np.concatenate([r[1] for r in results], axis=1)
+
+
+def sidereal_bins(interval):
+    """Returns the number of bins in one sidereal day and their length (hours, the closest
+    to interval), so that the bins span exactly one sidereal day.
+    """
+    nBins = int(round(SIDEREAL_DAY*24/interval))
+    return nBins, SIDEREAL_DAY*24/nBins
+
+
+def start_bins(startTimes, epoch, interval=0.2):
+    """Returns the bin of sidereal_metrics (for the given epoch and interval) of each start time."""
+    nBins = sidereal_bins(interval)[0]
+    angle = (earth_rotation_angle(startTimes) - earth_rotation_angle(epoch)) % (2*np.pi)
+    return np.round(angle/(2*np.pi)*nBins).astype(int) % nBins
+
+
+def plan_start_times(stations, firstDate, lastDate, duration, target=None, candidates=None, step=1.0,
+                     minEl=20, minStations=None, minWindow=0.5, interval=0.2, workers=None):
+    """Ranks the start times between firstDate and lastDate (every step hours) for an
+    observation of duration hours with the given stations.
+
+    Each start time is evaluated from its local sidereal time (see sidereal_metrics), so
+    the cost does not depend on the number of dates. Start times are rounded to the
+    nearest sidereal bin (up to interval/2), so the values can differ by one time sample
+    from a direct computation at the exact start time. Start times are ranked by the
+    fraction of the observation when all stations (or at least minStations) see the
+    target (if given), then by the number of fringe finders (candidates commonly visible
+    during at least minWindow hours), and then by date.
+
+    Inputs
+    ------
+    - stations : list of Station
+    - firstDate, lastDate : astropy.time.Time
+    - duration : float
+        Duration of the observation (hours).
+    - target : astropy.coordinates.SkyCoord
+        Target of the observation (optional).
+    - candidates : SourceTable
+        Possible fringe finders (e.g. from sources.load_rfc_cat), sorted by flux.
+    - step : float
+        Time (hours) between the start times to evaluate.
+
+    Output
+    ------
+    - plan : dict of arrays, sorted from the best start time
+        'start' (astropy.time.Time), 'targetCommon' (fraction), 'targetWindow' (hours),
+        'nFringeFinders', and 'fringeFinder' (name of the brightest one, '' if none).
+    """
+    epoch = firstDate + (lastDate - firstDate)/2
+    startTimes = firstDate + np.arange(0.0, (lastDate - firstDate).to_value(u.h) + step/2., step)*u.h
+    coords = []
+    if target is not None:
+        coords.append(target.reshape((1,)))
+    if candidates is not None and len(candidates) > 0:
+        coords.append(candidates.coord)
+    if len(coords) == 0:
+        raise ValueError("A target or candidate fringe finders are required")
+
+    # From the RA/Dec arrays, as coord.concatenate does not accept a single SkyCoord
+    coords = coord.SkyCoord(np.concatenate([c.ra.deg for c in coords])*u.deg,
+                            np.concatenate([c.dec.deg for c in coords])*u.deg)
+    fraction, longest = sidereal_metrics(stations, coords, duration, epoch, minEl,
+                                         minStations, interval, workers)
+    bins = start_bins(startTimes, epoch, interval)
+    fraction, longest = fraction[:,bins], longest[:,bins]
+    plan = {'start': startTimes}
+    if target is not None:
+        plan['targetCommon'], plan['targetWindow'] = fraction[0], longest[0]
+        fraction, longest = fraction[1:], longest[1:]
+    else:
+        plan['targetCommon'] = plan['targetWindow'] = np.full(len(startTimes), np.nan)
+
+    available = longest >= minWindow
+    plan['nFringeFinders'] = np.sum(available, axis=0)
+    if candidates is not None and len(candidates) > 0:
+        # Candidates are sorted by flux, so the first available one is the brightest
+        first = np.argmax(available, axis=0)
+        plan['fringeFinder'] = np.where(plan['nFringeFinders'] > 0, candidates.name[first], '')
+    else:
+        plan['fringeFinder'] = np.full(len(startTimes), '')
+
+    order = np.lexsort((np.arange(len(startTimes)), -plan['nFringeFinders'],
+                        -np.nan_to_num(plan['targetCommon'], nan=0.0)))
+    return {name: values[order] for name, values in plan.items()}
+
+
+def plan_table(plan, top=20):
+    """Returns the top start times of a plan (see plan_start_times) as a printable table (str)."""
+    lines = ["{:>3} {:16} {:>8} {:>10} {:>8} {}".format('#', 'Start (UTC)', 'Target', 'Window (h)', 'N. FF',
+                                                        'Brightest FF')]
+    for i in range(min(top, len(plan['start']))):
+        lines.append("{:3} {:16} {:>8} {:10.1f} {:8} {}".format(i, plan['start'][i].strftime('%d/%m/%Y %H:%M'),
+                     '-' if np.isnan(plan['targetCommon'][i]) else '{:.0%}'.format(plan['targetCommon'][i]),
+                     np.nan_to_num(plan['targetWindow'][i]), plan['nFringeFinders'][i], plan['fringeFinder'][i]))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    directory = path.dirname(path.realpath(__file__))
+    parser = argparse.ArgumentParser(description='Ranks the start times of an experiment over a range of dates by the common visibility of the target and the available fringe finders.\nBased on RfC catalogue.')
+    parser.add_argument('firstDate', type=str, help="First start time to consider. Format ='DD/MM/YYYY HH:MM'")
+    parser.add_argument('lastDate', type=str, help="Last start time to consider. Format ='DD/MM/YYYY HH:MM'")
+    parser.add_argument('duration', type=float, help="The duration of your experiment (in hours)")
+    parser.add_argument('stations', type=str, nargs='+', help="Space delimited list of stations")
+    parser.add_argument('-t', "--target", type=str, default=None, help="Coordinates of the target (hh:mm:ss dd:mm:ss).")
+    parser.add_argument('-s', "--step", type=float, default=1.0, help="Time between the start times to evaluate (hours). Defaults to 1.")
+    parser.add_argument('-b', "--band", type=str, default='c', help="Observing band, one of l, s, c, m, x, u, k, q. Defaults to c.")
+    parser.add_argument('-e', "--min-el", type=int, default=20, help="The minimum elevation to consider a source being 'up'. Defaults to 20.")
+    parser.add_argument('-f', "--min-flux", type=float, default=1.0, help="The mimimum flux density of the fringe finders. Defaults to 1.0 Jy")
+    parser.add_argument("--min-stations", type=int, default=None, help="Minimum number of stations that must see a source at the same time. Defaults to all of them.")
+    parser.add_argument("--min-window", type=float, default=0.5, help="Minimum common-visibility window of a fringe finder (hours). Defaults to 0.5.")
+    parser.add_argument('-n', "--top", type=int, default=20, help="Number of start times to show. Defaults to 20.")
+    parser.add_argument('-j', "--workers", type=int, default=None, help="Number of processes. Defaults to the number of cores.")
+    args = parser.parse_args()
+
+    stationList = Station.stations_from_file(directory+'/station_location.txt')
+    stations = [stationList[station.upper()] for station in args.stations]
+    rfcBand = rfc_band(args.band)
+    candidates = load_rfc_cat(directory+"/rfc_2021c_cat.txt", rfcBand, args.min_flux,
+                              decRange=declination_limits(stations, args.min_el*u.deg,
+                                                         min_stations=args.min_stations)).sort_by_flux(rfcBand)
+    plan = plan_start_times(stations, get_time(args.firstDate), get_time(args.lastDate), args.duration,
+                            target=get_coordinates(args.target) if args.target else None, candidates=candidates,
+                            step=args.step, minEl=args.min_el, minStations=args.min_stations,
+                            minWindow=args.min_window, workers=args.workers)
+    print(plan_table(plan, args.top))
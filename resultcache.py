@@ -0,0 +1,134 @@
+#Persistent (SQLite) cache of the elevations of the sources for repeated queries
+import time
+import sqlite3
+from os import path
+import numpy as np
+import astropy.units as u
+import astropy.coordinates as coord
+
+from stations import source_elevations
+from util_functions import cache_dir
+
+
+class ResultCache:
+    """On-disk cache of the elevations of (source, station) pairs on a given time grid.
+
+    The elevations are stored in a SQLite database as float32 arrays (in deg, rounded
+    down, so no elevation below a limit is moved above it) for each time grid (start
+    time, spacing and number of times), catalogue version and station-file version.
+    Rerunning a query with the same times and stations but other flux or elevation
+    limits only re-filters the stored elevations. The least recently used time grids
+    are evicted when the database is larger than maxSize.
+
+    It can be used as the elevationCache of sources.get_up_sources. Note that the
+    visibility is then decided from the elevations at the times of the grid, instead of
+    from the exact rise/set times.
+    """
+    def __init__(self, filename=None, maxSize=100*2**20, catalogueKey='', stationsKey='', fast=False):
+        """Inputs
+        ------
+        - filename : str
+            SQLite database. Defaults to results.sqlite in the cache directory.
+        - maxSize : int
+            Maximum size (in bytes) of the stored elevations.
+        - catalogueKey : str
+            Version of the catalogue (e.g. its hash), so results from other catalogues are not used.
+        - stationsKey : str
+            Version of the stations file (e.g. its hash).
+        - fast : bool
+            Compute the missing elevations with the fast analytic path (see
+            stations.source_elevations). Stored apart from the astropy ones.
+        """
+        self.filename = filename if filename is not None else path.join(cache_dir(), 'results.sqlite')
+        self.maxSize = maxSize
+        self.catalogueKey = catalogueKey
+        self.stationsKey = stationsKey
+        self.fast = fast
+        self._db = sqlite3.connect(self.filename)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS grids (id INTEGER PRIMARY KEY, key TEXT UNIQUE, "
+                             "lastUsed REAL, size INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS elevations (grid INTEGER, station TEXT, source TEXT, "
+                             "data BLOB, PRIMARY KEY (grid, station, source))")
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM elevations").fetchone()[0]
+
+    def size(self):
+        """Returns the size (in bytes) of the stored elevations."""
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM grids").fetchone()[0]
+
+    def clear(self):
+        with self._db:
+            self._db.execute("DELETE FROM elevations")
+            self._db.execute("DELETE FROM grids")
+        self._db.execute("VACUUM")
+
+    def close(self):
+        self._db.close()
+
+    def _grid(self, obs_times):
+        """Returns the id of the time grid (created if needed), marking it as used now."""
+        interval = (obs_times[1] - obs_times[0]).to_value(u.s) if len(obs_times) > 1 else 0.0
+        key = "f32:{}:{}:{:.8f}:{:.3f}:{}:{}".format(self.catalogueKey, self.stationsKey, obs_times[0].jd,
+                                                 interval, len(obs_times), 'fast' if self.fast else 'astropy')
+        with self._db:
+            self._db.execute("INSERT OR IGNORE INTO grids (key, lastUsed, size) VALUES (?, ?, 0)",
+                             (key, time.time()))
+            self._db.execute("UPDATE grids SET lastUsed = ? WHERE key = ?", (time.time(), key))
+        return self._db.execute("SELECT id FROM grids WHERE key = ?", (key,)).fetchone()[0]
+
+    def _evict(self, keep):
+        """Removes the least recently used grids (except keep) until the size is below maxSize."""
+        with self._db:
+            for grid, size in self._db.execute("SELECT id, size FROM grids WHERE id != ? ORDER BY lastUsed",
+                                               (keep,)).fetchall():
+                if self.size() <= self.maxSize:
+                    break
+                self._db.execute("DELETE FROM elevations WHERE grid = ?", (grid,))
+                self._db.execute("DELETE FROM grids WHERE id = ?", (grid,))
+
+    def elevations(self, stations, names, coords, obs_times):
+        """Returns the elevation of the sources as seen by the stations during obs_times,
+        as source_elevations does, with shape (N_sources, N_stations, N_times). Missing
+        sources are computed (for all stations in one batched transformation) and stored.
+
+        Inputs
+        ------
+        - stations : list of Station
+        - names : list of str
+            Unique names of the sources (used as keys of the cache).
+        - coords : astropy.coordinates.SkyCoord
+            Array with the coordinates of the sources.
+        - obs_times : astropy.time.Time
+            Array of times.
+        """
+        obs_times = obs_times.reshape((-1,))
+        names = [str(name) for name in names]
+        codes = [a_station.code for a_station in stations]
+        grid = self._grid(obs_times)
+        stored = {}
+        for code, name, data in self._db.execute("SELECT station, source, data FROM elevations WHERE grid = ?",
+                                                 (grid,)):
+            stored[(code, name)] = data
+
+        missing = [i for i, name in enumerate(names) if any((code, name) not in stored for code in codes)]
+        if len(missing) > 0:
+            computed = source_elevations(stations, coords.reshape((-1,))[missing], obs_times,
+                                         fast=self.fast).deg
+            rounded = computed.astype(np.float32)
+            rounded = np.where(rounded > computed, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+            rows = []
+            for i, a_source in zip(missing, rounded):
+                for code, values in zip(codes, a_source):
+                    stored[(code, names[i])] = values.tobytes()
+                    rows.append((grid, code, names[i], stored[(code, names[i])]))
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO elevations VALUES (?, ?, ?, ?)", rows)
+                self._db.execute("UPDATE grids SET size = (SELECT COALESCE(SUM(LENGTH(data)), 0) FROM elevations "
+                                 "WHERE grid = ?) WHERE id = ?", (grid, grid))
+            self._evict(grid)
+
+        elevations = np.array([[np.frombuffer(stored[(code, name)], dtype=np.float32) for code in codes]
+                               for name in names], dtype=float).reshape((len(names), len(codes), len(obs_times)))
+        return coord.Angle(elevations, unit=u.deg)
@@ -0,0 +1,118 @@
+#Selection of fringe-finder scans spread over the whole experiment
+import numpy as np
+import astropy.units as u
+
+
+class FringeFinderScan:
+    """A fringe-finder scan of the schedule: the source (a Source of the candidates table),
+    the slot it covers, its start and end times, and the codes of the stations that see
+    the source during the whole scan.
+    """
+    def __init__(self, slot, source, start, end, stations):
+        self.slot = slot
+        self.source = source
+        self.start = start
+        self.end = end
+        self.stations = stations
+
+
+def window_up(isUp, nSamples):
+    """Returns if the sources are up during nSamples consecutive times starting at each time,
+    for each station: shape (N_sources, N_stations, N_times - nSamples + 1).
+    """
+    down = np.concatenate([np.zeros(isUp.shape[:-1] + (1,), dtype=int), np.cumsum(~isUp, axis=-1)], axis=-1)
+    return (down[...,nSamples:] - down[...,:-nSamples]) == 0
+
+
+def schedule_fringe_finders(stationList, sources, obsTimes, spacing=3.0, scanLength=0.2, minStations=2,
+                            quality=None, minFluxBand='c'):
+    """Chooses one fringe-finder scan in each slot of spacing hours of the experiment, so
+    that the scans cover as many stations as possible.
+
+    The choice is greedy over all the candidate (source, start time) pairs at once: at each
+    step the pair with the largest number of stations not covered yet by the previous scans
+    (up during the whole scan) is scheduled in its slot, so every station gets a fringe
+    finder as soon as possible. Ties are broken by the total number of stations up, and
+    then by quality. Scans are kept at least spacing/2 hours apart. Steps
+    continue until every slot has a scan or no candidate left has at least minStations
+    stations up.
+
+    Inputs
+    ------
+    - stationList : list of Station
+        Stations, in the same order as in the visibility arrays of sources.
+    - sources : SourceTable
+        Candidates, as returned by sources.get_up_sources (with the 'isUp' column).
+    - obsTimes : astropy.time.Time
+        Times of the visibility arrays (regular grid).
+    - spacing : float
+        Length (hours) of each slot, i.e. the time between fringe finders.
+    - scanLength : float
+        Length (hours) of each scan.
+    - minStations : int
+        Minimum number of stations that must see the source during the scan.
+    - quality : ndarray
+        Value (higher is better) of each candidate, used to break ties. Defaults to the
+        expected fringe SNR if sources has it, or to the unresolved flux in minFluxBand.
+
+    Output
+    ------
+    - scans : list of FringeFinderScan, sorted by time.
+    """
+    if len(sources) == 0:
+        return []
+
+    obsTimes = obsTimes.reshape((-1,))
+    interval = (obsTimes[1] - obsTimes[0]).to_value(u.h) if len(obsTimes) > 1 else 1.0
+    nSamples = min(int(np.ceil(scanLength/interval - 1e-9)) + 1, len(obsTimes))
+    up = window_up(sources.isUp, nSamples)
+    nUp = np.sum(up, axis=1)
+    startHours = np.arange(up.shape[-1])*interval
+    slots = (startHours/spacing).astype(int)
+    if quality is None:
+        quality = sources.fringeSNR if 'fringeSNR' in sources.columns else sources.get_flux(minFluxBand)
+    quality = np.nan_to_num(np.asarray(quality, dtype=float), nan=0.0)
+    # In [0, 1), so it only breaks ties between the integer numbers of stations
+    tieBreak = (np.argsort(np.argsort(quality, kind='stable'), kind='stable')/len(quality))[:,np.newaxis]
+
+    covered = np.zeros(up.shape[1], dtype=bool)
+    free = np.ones(slots.max() + 1, dtype=bool)
+    allowed = np.ones(len(startHours), dtype=bool)
+    scans = []
+    while np.any(free):
+        newStations = np.sum(up & ~covered[np.newaxis,:,np.newaxis], axis=1)
+        score = np.where((nUp >= minStations) & (free[slots] & allowed)[np.newaxis,:],
+                         newStations*(up.shape[1] + 1) + nUp + tieBreak, -1.0)
+        best = np.unravel_index(np.argmax(score), score.shape)
+        if score[best] < 0.0:
+            break
+
+        iSource, iTime = best
+        free[slots[iTime]] = False
+        # Keeps the scans of neighbouring slots at least half a slot apart
+        allowed &= np.abs(startHours - startHours[iTime]) >= spacing/2.
+        covered |= up[iSource,:,iTime]
+        scans.append(FringeFinderScan(int(slots[iTime]), sources[int(iSource)], obsTimes[iTime],
+                                      obsTimes[iTime] + scanLength*u.h,
+                                      [a_station.code for a_station, isUp in zip(stationList, up[iSource,:,iTime])
+                                       if isUp]))
+
+    return sorted(scans, key=lambda scan: scan.slot)
+
+
+def slot_table(scans, allStations=None):
+    """Returns the schedule as a printable table (str), one line per scan. If allStations
+    (list of codes) is given, the stations not covered by any scan are listed at the end.
+    """
+    lines = ["{:>4} {:16} {:8} {:12} {:11} {}".format('Slot', 'Start (UTC)', 'End', 'Source name', 'Other name',
+                                                       'Stations')]
+    for scan in scans:
+        lines.append("{:4} {:16} {:8} {:12} {:11} {}".format(scan.slot, scan.start.strftime('%d/%m/%Y %H:%M'),
+                                                             scan.end.strftime('%H:%M'), scan.source.name,
+                                                             scan.source.ivsname, ' '.join(scan.stations)))
+    if allStations is not None:
+        covered = set(code for scan in scans for code in scan.stations)
+        missing = [code for code in allStations if code not in covered]
+        if len(missing) > 0:
+            lines.append("Stations without fringe finder: {}".format(' '.join(missing)))
+    return '\n'.join(lines)
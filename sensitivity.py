@@ -0,0 +1,103 @@
+#Thermal noise of the baselines and the array, and expected fringe SNR of the sources
+import numpy as np
+import astropy.units as u
+
+from uvcoverage import baseline_pairs
+
+# Wavelength (cm, as in the SEFD-<cm> columns of station_location.txt) used for each band.
+BAND_WAVELENGTHS = {'l': '18', 's': '13', 'c': '6', 'm': '5', 'x': '3.6', 'u': '1.3', 'k': '1.3', 'q': '0.7'}
+
+
+def band_wavelength(band):
+    """Returns the wavelength (str, in cm) of the station SEFDs for the observing band
+    (one of l, s, c, m, x, u, k, q). The U band uses the 1.3-cm SEFDs (there are no 2-cm ones).
+    """
+    if band.lower() not in BAND_WAVELENGTHS:
+        raise ValueError("Band {} is unknown.".format(band))
+    return BAND_WAVELENGTHS[band.lower()]
+
+
+def station_sefds(stations, band):
+    """Returns the SEFDs (Jy) of the stations at the observing band, as an array with NaN
+    for the stations that cannot observe at that band.
+    """
+    wavelength = band_wavelength(band)
+    return np.array([a_station.get_sefd(wavelength) if a_station.has_frequency(wavelength) else np.nan
+                     for a_station in stations], dtype=float)
+
+
+def baseline_noise(sefds, bandwidth, integration, efficiency=0.7):
+    """Returns the thermal noise (Jy) of all baselines (ordered as uvcoverage.baseline_pairs)
+    for the given station SEFDs (Jy), bandwidth and integration time:
+        sigma_ij = sqrt(SEFD_i SEFD_j) / (efficiency sqrt(2 bandwidth integration))
+    integration can be an array broadcastable to the baselines (in the last axis).
+    """
+    i, j = baseline_pairs(len(sefds))
+    samples = 2*bandwidth.to_value(u.Hz)*u.Quantity(integration, u.s).value
+    with np.errstate(divide='ignore'):
+        return np.sqrt(sefds[i]*sefds[j])/(efficiency*np.sqrt(samples))
+
+
+class Sensitivity:
+    """Expected noise and fringe SNR of a set of sources observed by an array.
+
+    All arrays are per source (first axis) and per baseline (second axis, ordered as
+    uvcoverage.baseline_pairs):
+    - baselines : list of (code1, code2)
+    - on_source : time (s) when both stations of each baseline see each source (N, B).
+    - baseline_noise : thermal noise (Jy) of each baseline in the fringe-fitting
+      interval, NaN if the baseline never sees the source or has no SEFD (N, B).
+    - baseline_snr : expected fringe SNR on each baseline (N, B).
+    - array_noise : thermal noise (Jy) of the whole observation of each source, from
+      all baselines and only the times when both stations are up (N).
+    - fringe_snr : expected fringe SNR of each source on its worst baseline (among the
+      ones that see it at some point), NaN if none does (N).
+    """
+    def __init__(self, baselines, on_source, baseline_noise, baseline_snr, array_noise, fringe_snr):
+        self.baselines = baselines
+        self.on_source = on_source
+        self.baseline_noise = baseline_noise
+        self.baseline_snr = baseline_snr
+        self.array_noise = array_noise
+        self.fringe_snr = fringe_snr
+
+
+def source_sensitivity(stations, fluxes, is_up, interval, band, bandwidth, integration, efficiency=0.7):
+    """Computes the Sensitivity of all sources and baselines at once.
+
+    Inputs
+    ------
+    - stations : list of Station
+    - fluxes : ndarray
+        Unresolved flux (Jy) of each source (N_sources).
+    - is_up : ndarray
+        Boolean array (N_sources, N_stations, N_times) telling if each source is up for
+        each station at each time of a regular grid.
+    - interval : astropy.units.Quantity
+        Spacing of the time grid.
+    - band : str
+        Observing band (one of l, s, c, m, x, u, k, q).
+    - bandwidth : astropy.units.Quantity
+        Total bandwidth of the observation.
+    - integration : astropy.units.Quantity
+        Fringe-fitting (solution) interval.
+    - efficiency : float
+        Correlator/digitization efficiency.
+    """
+    sefds = station_sefds(stations, band)
+    i, j = baseline_pairs(len(stations))
+    # Time when both stations of each baseline see each source
+    on_source = np.sum(is_up[:,i,:] & is_up[:,j,:], axis=2)*interval.to_value(u.s)
+    seen = on_source > 0.0
+    sigma = np.where(seen, baseline_noise(sefds, bandwidth, integration, efficiency)[np.newaxis,:], np.nan)
+    fluxes = np.asarray(fluxes, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(seen, 1.0/baseline_noise(sefds, bandwidth, on_source, efficiency)**2, 0.0)
+        total_weight = np.nansum(weights, axis=1)
+        array_noise = np.where(total_weight > 0.0, 1.0/np.sqrt(total_weight), np.nan)
+        baseline_snr = fluxes[:,np.newaxis]/sigma
+    fringe_snr = np.full(len(fluxes), np.nan)
+    ever_seen = np.any(np.isfinite(sigma), axis=1)
+    fringe_snr[ever_seen] = fluxes[ever_seen]/np.nanmax(sigma[ever_seen], axis=1)
+    return Sensitivity([(stations[a].code, stations[b].code) for a, b in zip(i, j)], on_source, sigma,
+                       baseline_snr, array_noise, fringe_snr)
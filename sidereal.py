@@ -0,0 +1,120 @@
+#Elevation cache based on the local sidereal time, reusable across dates
+from os import path
+import numpy as np
+import astropy.units as u
+import astropy.coordinates as coord
+from astropy.time import Time
+
+from stations import source_elevations, earth_rotation_angle
+
+# Length of a sidereal day (ratio with respect to the solar day).
+SIDEREAL_DAY = 1.0/1.00273781191135448
+
+
+class SiderealElevationCache:
+    """Stores the elevation of each (station, source) pair as a function of the local
+    sidereal time (LST) on a fine grid covering one sidereal day. The elevation of a
+    source only depends on the LST (apart from the slow precession and the annual
+    aberration), so any set of observing times, for any date within the validity
+    period, is answered by interpolating the stored curves at the right LST.
+
+    The grids are computed lazily (in one batched transformation for all missing
+    sources of a station) with the precise astropy path, and can be saved to disk.
+    With the default 2-min grid and within the validity period, the difference with the
+    direct computation is below 0.005 deg for elevations between -80 and 80 deg. It is
+    larger (up to ~0.1 deg) close to the zenith and the nadir, where the elevation
+    curve has a cusp.
+    """
+    def __init__(self, resolution=2*u.min, validity=30*u.day, filename=None):
+        """Inputs
+        ------
+        - resolution : astropy.units.Quantity
+            Step of the LST grid (as time).
+        - validity : astropy.units.Quantity
+            Maximum time between the reference epoch of the cache and the requested
+            times. When exceeded, the cache is cleared and rebuilt for the new epoch.
+        - filename : str
+            If given and it exists, the cache is loaded from this file.
+        """
+        self.nGrid = int(np.ceil((SIDEREAL_DAY*u.day/resolution).decompose().value))
+        self.validity = validity
+        self.reference = None
+        self._elevations = {}
+        if filename is not None and path.isfile(filename):
+            self.load(filename)
+
+    def __len__(self):
+        return len(self._elevations)
+
+    def clear(self, reference=None):
+        self.reference = reference
+        self._elevations = {}
+
+    def _local_sidereal_angle(self, station, obs_times):
+        # ERA plus the station longitude (i.e. the local sidereal angle respect to the CIO)
+        return (earth_rotation_angle(obs_times) + station.lon) % (2*np.pi)
+
+    def _grid_times(self, station):
+        """Times (after the reference epoch) at which the station has the LST of the grid."""
+        lstGrid = 2*np.pi*np.arange(self.nGrid)/self.nGrid
+        delta = (lstGrid - self._local_sidereal_angle(station, self.reference)) % (2*np.pi)
+        return self.reference + delta/(2*np.pi)*SIDEREAL_DAY*u.day
+
+    def _fill(self, station, names, coords):
+        missing = [i for i, name in enumerate(names) if (station.code, name) not in self._elevations]
+        if len(missing) == 0:
+            return
+
+        grid = source_elevations([station], coords[missing], self._grid_times(station))[:,0,:].deg
+        for i, elevations in zip(missing, grid.astype(np.float32)):
+            self._elevations[(station.code, names[i])] = elevations
+
+    def elevations(self, stations, names, coords, obs_times):
+        """Returns the elevation of the sources as seen by the stations during obs_times,
+        as source_elevations does, with shape (N_sources, N_stations, N_times).
+
+        Inputs
+        ------
+        - stations : list of Station
+        - names : list of str
+            Unique names of the sources (used as keys of the cache).
+        - coords : astropy.coordinates.SkyCoord
+            Array with the coordinates of the sources.
+        - obs_times : astropy.time.Time
+            Array of times.
+        """
+        obs_times = obs_times.reshape((-1,))
+        names = [str(name) for name in names]
+        coords = coords.reshape((-1,))
+        midTime = obs_times[len(obs_times)//2]
+        if (self.reference is None) or (abs(midTime - self.reference) > self.validity):
+            self.clear(midTime)
+
+        elevations = np.empty((len(names), len(stations), len(obs_times)))
+        for j, station in enumerate(stations):
+            self._fill(station, names, coords)
+            curves = np.array([self._elevations[(station.code, name)] for name in names])
+            # Linear interpolation on the (periodic) LST grid
+            position = self._local_sidereal_angle(station, obs_times)/(2*np.pi)*self.nGrid
+            i0 = np.floor(position).astype(int) % self.nGrid
+            weight = position - np.floor(position)
+            elevations[:,j,:] = curves[:,i0]*(1 - weight) + curves[:,(i0 + 1) % self.nGrid]*weight
+
+        return coord.Angle(elevations, unit=u.deg)
+
+    def save(self, filename):
+        """Saves the cache to disk (npz file)."""
+        keys = list(self._elevations.keys())
+        np.savez(filename, reference=self.reference.jd if self.reference is not None else np.nan,
+                 validity=self.validity.to_value(u.day), codes=np.array([k[0] for k in keys], dtype=str),
+                 names=np.array([k[1] for k in keys], dtype=str),
+                 elevations=np.array([self._elevations[k] for k in keys], dtype=np.float32).reshape(-1, self.nGrid))
+
+    def load(self, filename):
+        """Loads a cache previously saved with save. The grid resolution is taken from the file."""
+        with np.load(filename) as cached:
+            self.clear(None if np.isnan(cached['reference']) else Time(float(cached['reference']), format='jd'))
+            self.validity = float(cached['validity'])*u.day
+            self.nGrid = cached['elevations'].shape[1]
+            for code, name, elevations in zip(cached['codes'], cached['names'], cached['elevations']):
+                self._elevations[(str(code), str(name))] = elevations
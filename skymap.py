@@ -0,0 +1,66 @@
+#Visibility of the whole sky (RA/Dec grid) for an array of stations
+import numpy as np
+import astropy.units as u
+import astropy.coordinates as coord
+
+from stations import apparent_coordinates, hour_angle_elevations
+from sunmoon import body_separation
+
+
+class SkyVisibility:
+    """Lowest elevation among the stations of an array, at every time of an observation,
+    for every position of a RA/Dec grid (and optionally a list of sources).
+
+    The elevations are computed once (as in stations.fast_elevations, in chunks of
+    positions to bound the memory) and only their minimum over the stations is kept, so
+    the time of common visibility for any elevation limit is a simple threshold (hours).
+    The separations from the Sun and the Moon are also kept, so minimum separations can be
+    applied too.
+    """
+    def __init__(self, stations, obs_times, ra_step=2*u.deg, dec_step=2*u.deg, sources=None, chunk_size=2000):
+        """Inputs
+        ------
+        - stations : list of Station
+        - obs_times : astropy.time.Time
+            Times of the observation (regular grid).
+        - ra_step, dec_step : astropy.units.Quantity
+            Spacing of the grid.
+        - sources : astropy.coordinates.SkyCoord
+            Other positions (e.g. the calibrators of the catalogue) to compute as well.
+        - chunk_size : int
+            Number of positions computed at the same time.
+        """
+        obs_times = obs_times.reshape((-1,))
+        self.duration = (obs_times[-1] - obs_times[0]).to_value(u.h)
+        self.ra = np.arange(0.0, 360.0, ra_step.to_value(u.deg))
+        self.dec = np.arange(-90.0, 90.0 + dec_step.to_value(u.deg)/2, dec_step.to_value(u.deg))
+        ra, dec = np.meshgrid(self.ra, self.dec)
+        coords = coord.SkyCoord(ra.ravel()*u.deg, dec.ravel()*u.deg)
+        if sources is not None:
+            coords = coord.concatenate([coords, sources.reshape((-1,))])
+
+        # Only one astropy transformation, for all positions
+        ra, dec = apparent_coordinates(coords, obs_times)
+        self.min_elevation = np.empty((len(coords), len(obs_times)), dtype=np.float32)
+        for start in range(0, len(coords), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            self.min_elevation[chunk] = np.min(hour_angle_elevations(stations, ra[chunk], dec[chunk],
+                                                                     obs_times).deg, axis=1)
+        self.sun_separation = body_separation('sun', coords, obs_times).astype(np.float32)
+        self.moon_separation = body_separation('moon', coords, obs_times).astype(np.float32)
+
+    def hours(self, min_elevation, min_sun_separation=0.0, min_moon_separation=0.0):
+        """Returns the hours of common visibility (all stations above min_elevation, in deg)
+        of the grid (N_dec, N_ra) and of the sources (N_sources), counting only the times
+        when they are at least min_sun_separation and min_moon_separation (deg) away from
+        the Sun and the Moon.
+        """
+        up = self.min_elevation >= min_elevation
+        if min_sun_separation > 0.0:
+            up &= self.sun_separation >= min_sun_separation
+        if min_moon_separation > 0.0:
+            up &= self.moon_separation >= min_moon_separation
+        # As the fraction of the observation, so a source always up gets the full duration
+        hours = np.mean(up, axis=1)*self.duration
+        n_grid = len(self.ra)*len(self.dec)
+        return hours[:n_grid].reshape((len(self.dec), len(self.ra))), hours[n_grid:]
@@ -1,11 +1,25 @@
-from matplotlib import pyplot as plt
+from os import path
 from astropy import coordinates as coord
 import astropy.units as u
 import numpy as np
 from urllib import parse
-from urllib.request import urlopen
-from urllib.error import HTTPError
-from bs4 import BeautifulSoup as bs
+
+from util_functions import file_hash
+
+from stations import declination_limits
+from visibility import rise_set_intervals, common_visibility
+from sensitivity import source_sensitivity
+from sunmoon import separation_mask
+
+
+# Columns kept from the RfC catalogue. Fluxes are the resolved (R) and unresolved (U)
+# values for the S, C, X, U and K bands, with upper limits ('<') stored as 0.0.
+RFC_BANDS = ('s', 'c', 'x', 'u', 'k')
+RFC_DTYPE = np.dtype([('cal', 'U1'), ('ivsname', 'U8'), ('name', 'U10'), ('ra', 'f8'), ('dec', 'f8'),
+                      ('noObs', 'i4')] + [('flux{}{}'.format(band.upper(), kind), 'f8')
+                                          for band in RFC_BANDS for kind in ('R', 'U')])
+# Increase it every time RFC_DTYPE or the parsing changes, so old caches are discarded.
+RFC_CACHE_VERSION = 1
 
 
 class Flux:
@@ -22,26 +36,51 @@ class Flux:
         assert isinstance(resolvedFlux, float)
     
 class Source:
+    __slots__ = ('table', 'index')
 
-    def __init__(self, name, ivsname, coord, noObs, fluxes, calbool):
-        """Initializes a source.
+    def __init__(self, table, index):
+        """Initializes a source, which is a lightweight view of one row of a SourceTable.
 
         Inputs
         ------
-        - name: the J2000 name
-        - ivsname: the ivsname
-        - coord: astropy coord 
-        - noObs: the number of times this source has been observed in the IVS cat (useful filter maybe)
-        - fluxes: dict of fluxes with band as key names.
+        - table: the SourceTable containing the source
+        - index: the row of the source in the table
         """
-        self.name = name
-        self.ivsname = ivsname
-        self.coord = coord
-        self._noObs = noObs
-        self.flux = fluxes
-        self.isCal = calbool
-        
+        self.table = table
+        self.index = index
+
+    @property
+    def name(self):
+        """The J2000 name"""
+        return str(self.table.name[self.index])
+
+    @property
+    def ivsname(self):
+        return str(self.table.ivsname[self.index])
+
+    @property
+    def coord(self):
+        """astropy coord of the source"""
+        return self.table.coord[self.index]
+
+    @property
+    def _noObs(self):
+        """The number of times this source has been observed in the IVS cat (useful filter maybe)"""
+        return int(self.table.noObs[self.index])
+
+    @property
+    def flux(self):
+        """Dict of fluxes with band as key names."""
+        return {band: Flux(float(self.table.resolved[self.index, i]),
+                           float(self.table.unresolved[self.index, i])) for i, band in enumerate(RFC_BANDS)}
+
+    @property
+    def isCal(self):
+        return bool(self.table.isCal[self.index])
+
     def plot_elevation(self, stations, obsTimes):
+        # matplotlib is slow to import and only needed here
+        from matplotlib import pyplot as plt
         f = plt.figure(1, figsize=(10,5))
         ax = f.add_subplot(111)
         ax.set_title("Elevation vs time for {}".format(self.name))
@@ -54,94 +93,441 @@ class Source:
         plt.legend()
         plt.show()
 
-    def find_nmes(self):
-        #scrape the ftp tests
-        ftpPage = urlopen("http://old.evlbi.org/tog/ftp_fringes/ftp.html")
-        bsFtpPage = bs(ftpPage.read(), features="html5lib")
-        links=[]
-        for link in bsFtpPage.findAll('a'):
-            href = link.get('href')
-            if "ftp_fringes" in href:
-                try:
-                    ftPage = urlopen(href)
-                    ftPageTxt = str(ftPage.read())
-                    if self.name in ftPageTxt:
-                        links.append(link.get('href'))
-                    elif self.ivsname in ftPageTxt:
-                        links.append(link.get('href'))
-                except HTTPError as err:
-                    pass
-        return links
+    def find_nmes(self, index=None):
+        """Returns the links to the NMEs that included this source (by J2000 or IVS name),
+        answered from an NMEIndex (the shared nme.default_index() if not given).
+        """
+        if index is None:
+            # Imported when needed, as it pulls BeautifulSoup and urllib.request
+            import nme
+            index = nme.default_index()
+        return index.find(self.name, self.ivsname)
 
     def get_astrogeo_link(self):
         #get a link for the astrogeo html section for this source (contains maps/uvrad etc)
         sourceCoordString = parse.quote("ra={:02.0f}:{:02.0f}:{:06.3f}&dec={:+03.0f}:{:02.0f}:{:06.3f}&num_sou=1&format=html".format(*self.coord.ra.hms, *self.coord.dec.dms), safe='=&')
         return("http://astrogeo.org/cgi-bin/calib_search_form.csh?{}".format(sourceCoordString))
-        
-    
-# def load_rfc_cat(filename):
-#     #loads the data initially from the rfc catalogue, note we have to take care of < in the fluxes. We ignore position error columns
-#     sourceCat = np.loadtxt(filename,
-#                            comments='#',
-#                            dtype={'names': ('cal', 'ivsname', 'name', 'raH', 'raM', 'raS', 'decD', 'decM',
-#                                             'decS', 'noObs', 'fluxSR', 'fluxSU', 'fluxCR', 'fluxCU',
-#                                             'fluxXR', 'fluxXU', 'fluxUR', 'fluxUU', 'fluxKR', 'fluxKU'),
-#                                   'formats': ('bool', '|S15', '|S15', 'int', 'int', 'float', 'int', 'int',
-#                                               'float', 'int', 'float', 'float', 'float', 'float', 'float',
-#                                               'float', 'float', 'float', 'float', 'float')},
-#                            usecols=(0,1,2,3,4,5,6,7,8,12,13,14,15,16,17,18,19,20,21,22),
-#                            converters={0: lambda cal: True if cal.decode()=='C' else False,
-#                                        13: lambda f: 0.0 if '<' in str(f) else f,
-#                                        14: lambda f: 0.0 if '<' in str(f) else f,
-#                                        15: lambda f: 0.0 if '<' in str(f) else f,
-#                                        16: lambda f: 0.0 if '<' in str(f) else f,
-#                                        17: lambda f: 0.0 if '<' in str(f) else f,
-#                                        18: lambda f: 0.0 if '<' in str(f) else f,
-#                                        19: lambda f: 0.0 if '<' in str(f) else f,
-#                                        20: lambda f: 0.0 if '<' in str(f) else f,
-#                                        21: lambda f: 0.0 if '<' in str(f) else f,
-#                                        22: lambda f: 0.0 if '<' in str(f) else f})
-
-#     return sourceCat
-
-def load_rfc_cat(filename, minFluxBand='c', minFlux=1.0):
+
+
+class SourceTable:
+    """Catalogue of sources stored as NumPy columns (one array per property), so that
+    filtering, masking and sorting are vectorized. Rows are accessed as Source views.
+
+    Columns: name, ivsname, ra and dec (rad), noObs, isCal, and the resolved and
+    unresolved fluxes (Jy) with shape (N_sources, N_bands), with bands in RFC_BANDS.
+    Derived per-source columns can be attached with add_column.
+    """
+    def __init__(self, columns, coords=None):
+        """Initializes the table from a dict of columns with the same length.
+        coords (optional) is the SkyCoord of the sources, otherwise built when needed.
+        """
+        self.columns = columns
+        self._coords = coords
+        self._decOrder = None
+        self._fluxOrder = {}
+
+    @classmethod
+    def from_catalogue(cls, catalogue):
+        """Creates the table from a structured array as returned by read_rfc_cat."""
+        return cls({'name': catalogue['name'], 'ivsname': catalogue['ivsname'],
+                    'ra': catalogue['ra'], 'dec': catalogue['dec'], 'noObs': catalogue['noObs'],
+                    'isCal': catalogue['cal'] == 'C',
+                    'resolved': np.stack([catalogue['flux{}R'.format(band.upper())]
+                                          for band in RFC_BANDS], axis=1),
+                    'unresolved': np.stack([catalogue['flux{}U'.format(band.upper())]
+                                            for band in RFC_BANDS], axis=1)})
+
+    def __len__(self):
+        return len(self.columns['name'])
+
+    def __iter__(self):
+        return (Source(self, i) for i in range(len(self)))
+
+    def __getitem__(self, key):
+        """An integer returns the Source in that row. A slice, boolean mask or array of
+        indices returns a new SourceTable with the selected rows.
+        """
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError("Source index out of range")
+            return Source(self, int(key))
+
+        return SourceTable({name: values[key] for name, values in self.columns.items()},
+                           None if self._coords is None else self._coords[key])
+
+    def __getattr__(self, name):
+        # Columns are accessible as attributes (e.g. table.name)
+        try:
+            return self.__dict__['columns'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @property
+    def coord(self):
+        """SkyCoord array with the positions of all sources."""
+        if self._coords is None:
+            self._coords = coord.SkyCoord(ra=self.columns['ra']*u.rad, dec=self.columns['dec']*u.rad)
+        return self._coords
+
+    def in_declination_range(self, low, high):
+        """Returns a table with the sources with low <= dec <= high (astropy angles).
+        The sources are found by a binary search on the (cached) sorted declinations.
+        """
+        if self._decOrder is None:
+            self._decOrder = np.argsort(self.columns['dec'], kind='stable')
+        sortedDec = self.columns['dec'][self._decOrder]
+        first = np.searchsorted(sortedDec, low.to_value(u.rad), side='left')
+        last = np.searchsorted(sortedDec, high.to_value(u.rad), side='right')
+        return self[np.sort(self._decOrder[first:last])]
+
+    def add_column(self, name, values):
+        """Attaches a per-source column (it follows the rows when filtering or sorting)."""
+        assert len(values) == len(self)
+        self.columns[name] = np.asarray(values)
+
+    def get_flux(self, band, resolved=False):
+        """Returns the (un)resolved flux of all sources at the given band."""
+        return self.columns['resolved' if resolved else 'unresolved'][:, RFC_BANDS.index(band)]
+
+    def filter(self, mask):
+        """Returns a table with only the rows where mask is True."""
+        return self[np.asarray(mask, dtype=bool)]
+
+    def sort_by(self, values, reverse=True):
+        """Returns the table sorted by values (one per source), descending by default.
+        The sort is stable (in both directions), so sorts can be chained to break ties.
+        """
+        values = np.asarray(values)
+        if reverse:
+            # Stable descending order (ties keep their current order)
+            return self[len(values) - 1 - np.argsort(values[::-1], kind='stable')[::-1]]
+
+        return self[np.argsort(values, kind='stable')]
+
+    def sort_by_flux(self, band, resolved=False, reverse=True):
+        """Returns the table sorted by the flux at the given band, brightest first by default."""
+        if reverse:
+            return self[self.flux_order(band, resolved)]
+        return self.sort_by(self.get_flux(band, resolved), reverse)
+
+    def flux_order(self, band, resolved=False):
+        """Returns the indices of the sources from the brightest to the faintest at the
+        given band (stable for equal fluxes, as sort_by). They are computed once per band
+        and kind of flux, and kept for the next queries.
+        """
+        key = (band, resolved)
+        if key not in self._fluxOrder:
+            values = self.get_flux(band, resolved)
+            self._fluxOrder[key] = len(values) - 1 - np.argsort(values[::-1], kind='stable')[::-1]
+        return self._fluxOrder[key]
+
+    def brightest(self, band, minFlux=None, resolved=False):
+        """Returns the sources with a flux at the given band larger than minFlux (all if None),
+        sorted from the brightest, from the (cached) flux order of the band.
+        """
+        order = self.flux_order(band, resolved)
+        if minFlux is not None:
+            # Fluxes along order are descending, so the selected ones are a prefix
+            order = order[:np.searchsorted(-self.get_flux(band, resolved)[order], -minFlux, side='left')]
+        return self[order]
+
+    def top(self, values, k):
+        """Returns the sources (in their current order) with the k highest values, selected
+        with a partition instead of a full sort. Sources tied with the k-th value are also
+        kept, so the table can be sorted afterwards exactly as the full one.
+        """
+        values = np.asarray(values)
+        if k >= len(values):
+            return self
+        kth = values[np.argpartition(values, len(values) - k)[len(values) - k]]
+        return self.filter(values >= kth)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """Returns a table with the rows of all the given tables (with the same columns)."""
+        tables = list(tables)
+        return cls({name: np.concatenate([table.columns[name] for table in tables])
+                    for name in tables[0].columns})
+
+
+def rfc_band(band):
+    """Returns the RfC band (one of RFC_BANDS) closest to the observing band, which is one
+    of l, s, c, m, x, u, k, q (the RfC only has fluxes for the S, C, X, U and K bands).
+    """
+    bands = {'l': 's', 's': 's', 'c': 'c', 'm': 'c', 'x': 'x', 'u': 'u', 'k': 'k', 'q': 'k'}
+    if band.lower() not in bands:
+        raise ValueError("Band {} is unknown.".format(band))
+    return bands[band.lower()]
+
+
+def _parse_rfc_line(cols):
+    ra = (float(cols[3]) + float(cols[4])/60. + float(cols[5])/3600.)*np.pi/12.
+    dec = (abs(float(cols[6])) + float(cols[7])/60. + float(cols[8])/3600.)*np.pi/180.
+    if cols[6].startswith('-'):
+        dec = -dec
+    fluxes = [float(f) if '<' not in f else 0.0 for f in cols[13:23]]
+    return (cols[0], cols[1], cols[2], ra, dec, int(cols[12]), *fluxes)
+
+
+def iter_rfc_cat(filename, chunkSize=4096, classes=None, minFluxBand='c', minFlux=None, decRange=None):
+    """Parses the RfC catalogue text file lazily, yielding the sources in chunks (structured
+    arrays with RFC_DTYPE, with at most chunkSize rows). RA and Dec are stored in radians.
+
+    The filters are applied on the raw columns of each line before anything else is
+    converted, so the parsing time and the memory scale with the selected sources.
+
+    Inputs
+    ------
+    - filename : str
+    - chunkSize : int
+        Maximum number of sources in each yielded array.
+    - classes : str or list of str
+        Source classes to keep ('C' calibrators, 'N' non-calibrators, 'U' unreliable).
+        All if None.
+    - minFluxBand : str
+        RfC band (one of RFC_BANDS) used for the flux cut.
+    - minFlux : float
+        Only sources with an unresolved flux (Jy) in minFluxBand larger than minFlux are kept.
+    - decRange : tuple of astropy.units.Quantity
+        Only sources with (catalogue) declination within (lowest, highest) are kept.
+    """
+    fluxColumn = 14 + 2*RFC_BANDS.index(minFluxBand)
+    if decRange is not None:
+        decLow, decHigh = (limit.to_value(u.deg) for limit in decRange)
+
+    rows = []
     with open(filename, 'rt') as fin:
-        coordStrings = []
-        sources = []
-        coord0 = coord.SkyCoord("00h00m00.0s +00d00m00.0s")
         for line in fin:
-            if not (line.startswith('#') or line.startswith('N') or line.startswith('U')):
-                cols = line.split()
-                cols[13:23] = [float(f)  if '<' not in f else 0.0 for f in cols[13:23]]
-                fluxes = {'s': Flux(cols[13], cols[14]),
-                          'c': Flux(cols[15], cols[16]),
-                          'x': Flux(cols[17], cols[18]),
-                          'u': Flux(cols[19], cols[20]),
-                          'k': Flux(cols[21], cols[22])}
-                if fluxes[minFluxBand].unresolved > minFlux:
-                    name = cols[2]
-                    ivsname = cols[1]
-                    #coords = coord.SkyCoord("{}h{}m{}s {}d{}m{}s".format(*cols[3:9]))
-                    coordStrings.append("{}h{}m{}s {}d{}m{}s".format(*cols[3:9]))
-                    sources.append(Source(name, ivsname, coord0, int(cols[12]), fluxes, True))
-    coords = coord.SkyCoord(np.array(coordStrings))
-    
-    for c,s in zip(coords, sources):
-        s.coord = c
-    return sources
+            if line.startswith('#') or line.strip() == '':
+                continue
+            cols = line.split()
+            if (classes is not None) and (cols[0] not in classes):
+                continue
+            if (minFlux is not None) and (('<' in cols[fluxColumn]) or (float(cols[fluxColumn]) <= minFlux)):
+                continue
+            if decRange is not None:
+                dec = abs(float(cols[6])) + float(cols[7])/60. + float(cols[8])/3600.
+                if cols[6].startswith('-'):
+                    dec = -dec
+                if not decLow <= dec <= decHigh:
+                    continue
 
+            rows.append(_parse_rfc_line(cols))
+            if len(rows) == chunkSize:
+                yield np.array(rows, dtype=RFC_DTYPE)
+                rows = []
 
+    if len(rows) > 0:
+        yield np.array(rows, dtype=RFC_DTYPE)
 
-def get_up_sources(stationList, sourceList, obsTimes, minEl=20, minFlux=0.5, minFluxBand='c'):
-    sources=[]
-    for source in sourceList:
-        for station in stationList:
-            if not station.is_source_visible(source.coord, obsTimes, minEl*u.deg):
-                break
-        else:
-            sources.append(source)
 
-    
-    sources.sort(key=lambda source:source.flux[minFluxBand].unresolved, reverse=True)
-    return sources
+def parse_rfc_cat(filename, **filters):
+    """Parses the RfC catalogue text file and returns its sources as a structured
+    array with RFC_DTYPE. RA and Dec are stored in radians. The sources can be
+    selected with the filters accepted by iter_rfc_cat (all are returned by default).
+    """
+    chunks = list(iter_rfc_cat(filename, **filters))
+    return np.concatenate(chunks) if len(chunks) > 0 else np.empty(0, dtype=RFC_DTYPE)
+
+
+def read_rfc_cat(filename, useCache=True):
+    """Returns the full RfC catalogue (see parse_rfc_cat) as a structured array.
+
+    The parsed catalogue is cached in a .npz file next to the text file, so only the
+    first call pays the parsing cost. The cache is rebuilt if the text file has been
+    modified (different mtime and different content hash).
+    """
+    cacheFile = path.splitext(filename)[0] + '.npz'
+    mtime = path.getmtime(filename)
+    fileHash = None
+    if useCache and path.isfile(cacheFile):
+        try:
+            with np.load(cacheFile) as cached:
+                if int(cached['version']) == RFC_CACHE_VERSION:
+                    if float(cached['mtime']) == mtime:
+                        return cached['catalogue']
+                    fileHash = file_hash(filename)
+                    catalogue = cached['catalogue'] if str(cached['sha1']) == fileHash else None
+        except (OSError, ValueError, KeyError):
+            catalogue = None
+
+        if fileHash is not None and catalogue is not None:
+            # Only the mtime changed: refresh it to skip the hash the next time
+            _write_rfc_cache(cacheFile, catalogue, mtime, fileHash)
+            return catalogue
+
+    catalogue = parse_rfc_cat(filename)
+    if useCache:
+        _write_rfc_cache(cacheFile, catalogue, mtime, fileHash or file_hash(filename))
+    return catalogue
+
+
+def _write_rfc_cache(cacheFile, catalogue, mtime, fileHash):
+    try:
+        with open(cacheFile, 'wb') as fout:
+            np.savez(fout, catalogue=catalogue, version=RFC_CACHE_VERSION, mtime=mtime, sha1=fileHash)
+    except OSError:
+        # The cache is optional (e.g. read-only installation)
+        pass
+
+
+def load_rfc_cat(filename, minFluxBand='c', minFlux=1.0, useCache=True, decRange=None):
+    """Loads the calibrators (class 'C') from the RfC catalogue that have an unresolved
+    flux in minFluxBand larger than minFlux (in Jy), and optionally a declination within
+    decRange (lowest, highest). Returns a SourceTable.
+
+    With useCache, the full catalogue is read from (or stored in) the .npz cache (see
+    read_rfc_cat) and filtered as arrays. Otherwise the text file is streamed and only
+    the selected sources are parsed (see iter_rfc_cat).
+    """
+    if not useCache:
+        return SourceTable.from_catalogue(parse_rfc_cat(filename, classes='C', minFluxBand=minFluxBand,
+                                                        minFlux=minFlux, decRange=decRange))
+
+    catalogue = read_rfc_cat(filename, useCache)
+    selected = (catalogue['cal'] == 'C') & (catalogue['flux{}U'.format(minFluxBand.upper())] > minFlux)
+    if decRange is not None:
+        dec = np.degrees(catalogue['dec'])
+        selected &= (dec >= decRange[0].to_value(u.deg)) & (dec <= decRange[1].to_value(u.deg))
+    return SourceTable.from_catalogue(catalogue[selected])
+
+
+
+def get_up_sources(stationList, sourceList, obsTimes, minEl=20, minFlux=0.5, minFluxBand='c', fast=False,
+                   elevationCache=None, minStations=None, minCommon=0.0, rankBy='flux', obsBand=None,
+                   bandwidth=256*u.MHz, integration=60*u.s, top=None, minSunSeparation=None,
+                   minMoonSeparation=None):
+    """Returns the sources (SourceTable) that are visible (above minEl degrees) at some point
+    during obsTimes for all the stations in stationList, sorted by their unresolved flux in minFluxBand.
+
+    The visibility is decided from the exact rise/set times of every source and station
+    (visibility.rise_set_intervals), computed in one vectorized pass and refined with the
+    astropy elevations unless fast. If elevationCache (a sidereal.SiderealElevationCache)
+    is given, the elevations at obsTimes are interpolated from it instead.
+
+    The returned table also has the common-visibility metrics (visibility.common_visibility)
+    on the obsTimes grid: 'commonFraction', the fraction of the observation when all
+    stations (or at least minStations) see the source at the same time, and
+    'longestWindow', the longest of these windows in hours, and 'isUp', if the source is
+    up for each station at each time (N_sources, N_stations, N_times). If minStations is given, a
+    source is kept if at least minStations see it at the same time at some point (instead
+    of requiring that every station sees it). Sources with commonFraction below minCommon
+    are discarded. rankBy can be 'flux', 'common' (commonFraction), 'window'
+    (longestWindow) or 'snr' (fringeSNR); ties are sorted by flux.
+
+    If obsBand (the observing band, one of l, s, c, m, x, u, k, q) is given, the table
+    also has the expected sensitivity (sensitivity.source_sensitivity) from the station
+    SEFDs, the unresolved flux in minFluxBand, the bandwidth and the fringe-fitting
+    integration time: 'fringeSNR', the fringe SNR on the worst baseline that sees the
+    source, and 'arrayNoise', the thermal noise (Jy) of the whole observation counting
+    only the times when both stations of each baseline are up. It is required by rankBy='snr'.
+
+    If minSunSeparation or minMoonSeparation (astropy angles) are given, a source is only
+    considered up at the times when it is at least that far from the Sun or the Moon
+    (sunmoon.separation_mask, computed once per time for all sources).
+
+    If top is given, only the top sources are returned (selected with a partition of the
+    ranking values, so only them are fully sorted).
+    """
+    if rankBy not in ('flux', 'common', 'window', 'snr'):
+        raise ValueError("Unknown ranking {}".format(rankBy))
+    if (rankBy == 'snr') and (obsBand is None):
+        raise ValueError("Ranking by SNR requires the observing band (obsBand)")
+
+    # Discard first the sources that never reach minEl for enough stations
+    sourceList = sourceList.in_declination_range(*declination_limits(stationList, minEl*u.deg,
+                                                                      min_stations=minStations))
+    if len(sourceList) == 0:
+        return sourceList
+
+    if elevationCache is not None:
+        elevations = elevationCache.elevations(stationList, sourceList.name, sourceList.coord, obsTimes)
+        isUp = elevations >= minEl*u.deg
+        isVisible = np.any(isUp, axis=2)
+    else:
+        intervals = rise_set_intervals(stationList, sourceList.coord, obsTimes[0], obsTimes[-1] - obsTimes[0],
+                                       minEl*u.deg, refine=not fast)
+        isUp = intervals.mask(obsTimes)
+        isVisible = intervals.is_visible()
+
+    if (minSunSeparation is not None) or (minMoonSeparation is not None):
+        isUp &= separation_mask(sourceList.coord, obsTimes, minSunSeparation, minMoonSeparation)[:,np.newaxis,:]
+        isVisible = np.any(isUp, axis=2)
+
+    interval = (obsTimes[1] - obsTimes[0]).to_value(u.h) if len(obsTimes) > 1 else 0.0
+    commonFraction, longestWindow = common_visibility(isUp, interval, minStations)
+    sourceList.add_column('commonFraction', commonFraction)
+    sourceList.add_column('longestWindow', longestWindow)
+    sourceList.add_column('isUp', isUp)
+    if minStations is None:
+        # Visible if every station sees it at some time
+        keep = np.all(isVisible, axis=1)
+    else:
+        # Visible if enough stations see it at the same time at some sample
+        keep = commonFraction > 0.0
+
+    keep &= commonFraction >= minCommon
+    sources = sourceList.filter(keep)
+    if obsBand is not None:
+        sensitivity = source_sensitivity(stationList, sources.get_flux(minFluxBand), sources.isUp, interval*u.h,
+                                         obsBand, bandwidth, integration)
+        sources.add_column('fringeSNR', sensitivity.fringe_snr)
+        sources.add_column('arrayNoise', sensitivity.array_noise)
+
+    if top is not None:
+        sources = sources.top(_rank_values(sources, rankBy, minFluxBand), top)
+    sources = sources.sort_by_flux(minFluxBand)
+    if rankBy != 'flux':
+        sources = sources.sort_by(_rank_values(sources, rankBy, minFluxBand))
+
+    return sources if top is None else sources[:top]
+
+
+def _rank_values(sources, rankBy, band):
+    """Values (larger is better) used to rank the sources in get_up_sources."""
+    if rankBy == 'flux':
+        return sources.get_flux(band)
+    if rankBy == 'common':
+        return sources.commonFraction
+    if rankBy == 'window':
+        return sources.longestWindow
+    # Sources without any baseline with SEFDs at the band go last
+    return np.nan_to_num(sources.fringeSNR, nan=-np.inf)
+
+
+def get_top_sources(stationList, sourceList, obsTimes, top=10, minFluxBand='c', minFlux=None, rankBy='flux',
+                    batchSize=None, **kwargs):
+    """Returns the top sources (SourceTable) that get_up_sources would return first, without
+    testing the visibility of the whole sourceList when possible.
+
+    When ranking by flux, the sources are walked from the brightest at minFluxBand (with
+    the cached flux order of sourceList, see SourceTable.brightest) in batches of batchSize
+    sources (by default 4*top, doubled after each batch), stopping as soon as top sources
+    pass the visibility test. For the other rankings all sources are tested, and only the
+    top ones are sorted. Other arguments as in get_up_sources.
+    """
+    if minFlux is not None:
+        sourceList = sourceList.brightest(minFluxBand, minFlux)
+    if rankBy != 'flux':
+        return get_up_sources(stationList, sourceList, obsTimes, minFluxBand=minFluxBand, rankBy=rankBy,
+                              top=top, **kwargs)
+
+    minEl = kwargs.get('minEl', 20)
+    candidates = sourceList.in_declination_range(*declination_limits(stationList, minEl*u.deg,
+                                                                      min_stations=kwargs.get('minStations')))
+    candidates = candidates.brightest(minFluxBand)
+    batchSize = batchSize or max(4*top, 16)
+    found, nFound, start = [], 0, 0
+    while (nFound < top) and (start < len(candidates)):
+        batch = get_up_sources(stationList, candidates[start:start+batchSize], obsTimes,
+                               minFluxBand=minFluxBand, rankBy=rankBy, **kwargs)
+        found.append(batch)
+        nFound += len(batch)
+        start += batchSize
+        batchSize *= 2
 
+    if len(found) == 0:
+        return candidates
+    return SourceTable.concatenate(found)[:top]
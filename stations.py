@@ -1,14 +1,19 @@
 import numpy as np
 import astropy.units as u
 import astropy.coordinates as coord
-from astropy.io import ascii
 #from sources import Source
 
 class Station:
+    """A station of a StationArray (a light view on its row of the registry arrays).
+    All the per-station values (location, geodetic coordinates, SEFDs) are read from the
+    arrays of the registry, which are computed only once when the stations are loaded.
+    """
+    __slots__ = ('_registry', '_row')
 
     def __init__(self, name, codename, location, sefds):
         """Initializes a station. The given name must be the name of the station that
         observes, with the typical 2-letter format used in the EVN (with exceptions).
+        The station is the only member of a new StationArray.
 
         Inputs
         ------
@@ -23,10 +28,63 @@ class Station:
             in cm. The values will be given in Jy. If a wavelngth is given, a correct
             SEFD is assumed (i.e. no empty or n/a values are expected to be found).
         """
-        self.name = name
-        self.code = codename
-        self.location = location
-        self.sefd = sefds
+        xyz = [[location.x.to_value(u.m), location.y.to_value(u.m), location.z.to_value(u.m)]]
+        registry = StationArray([codename], [name], xyz, list(sefds.keys()), [list(sefds.values())])
+        self._registry = registry
+        self._row = 0
+
+    @classmethod
+    def _view(cls, registry, row):
+        """Returns the Station for the given row of the registry (a StationArray)."""
+        station = cls.__new__(cls)
+        station._registry = registry
+        station._row = row
+        return station
+
+    def __repr__(self):
+        return "Station({!r}, {!r})".format(self.name, self.code)
+
+    def __reduce__(self):
+        return (Station._view, (self._registry, self._row))
+
+    @property
+    def name(self):
+        return self._registry.names[self._row]
+
+    @property
+    def code(self):
+        return self._registry.codes[self._row]
+
+    @property
+    def location(self):
+        return self._registry.locations[self._row]
+
+    @property
+    def xyz(self):
+        """Geocentric (ECEF) position, in meters."""
+        return self._registry.xyz[self._row]
+
+    @property
+    def lat(self):
+        """Geodetic latitude, in radians."""
+        return self._registry.lat[self._row]
+
+    @property
+    def lon(self):
+        """Geodetic longitude, in radians."""
+        return self._registry.lon[self._row]
+
+    @property
+    def enu(self):
+        """Rotation matrix (3x3) from geocentric (ECEF) vectors to the local East, North, Up frame."""
+        return self._registry.enu[self._row]
+
+    @property
+    def sefd(self):
+        """SEFDs as a dict where keys are the wavelengths (cm) that the station can observe."""
+        return {wavelength: float(value) for wavelength, value in zip(self._registry.wavelengths,
+                                                                self._registry.sefds[self._row])
+                if not np.isnan(value)}
 
 
     def stations_from_file(filename):
@@ -34,27 +92,13 @@ class Station:
         name_observer code_observer X Y Z
         The header of this file should be "station code x y z", matching the previous fields
 
-        Returns a dict with the observers. The keys are the code_observer.
+        Returns the observers as a StationArray, which can be used as a dict where the keys
+        are the code_observer.
         """
-        file_with_stations = ascii.read(filename)
-        # Getting the frequencies with SEFD values
-        sefds = [acol for acol in file_with_stations.colnames if 'SEFD-' in acol]
-
-        stations = {}
-        for a_line in file_with_stations:
-            a_loc = coord.EarthLocation(a_line['x']*u.m, a_line['y']*u.m, a_line['z']*u.m)
-            stat_sefds = {}
-            for a_sefd in sefds:
-                if a_line[a_sefd] != -1:
-                    stat_sefds[a_sefd.split('-')[1]] = a_line[a_sefd]
-
-            stations[a_line['code']] = Station(a_line['station'], a_line['code'], a_loc,
-                                               stat_sefds)
-
-        return stations
+        return StationArray.from_file(filename)
 
 
-    def source_elevation(self, source_coord, obs_times):
+    def source_elevation(self, source_coord, obs_times, fast=False):
         """Returns the elevation of the source as seen by the Station during obs_times.
 
         Inputs
@@ -63,12 +107,23 @@ class Station:
             Coordinates of the source to observe.
         - obs_times : astropy.time.Time
             Time to compute the elevation of the source (either single time or a list of times).
+        - fast : bool
+            If True, uses the analytic hour-angle approximation (see fast_elevations)
+            instead of the full astropy AltAz transformation.
 
         Output
         ------
         - elevations : ndarray
             Elevation of the source at the given obs_times
         """
+        if fast:
+            elevations = fast_elevations([self], source_coord, obs_times)[:,0,:]
+            if source_coord.isscalar:
+                elevations = elevations[0]
+            if obs_times.isscalar:
+                elevations = elevations[...,0]
+            return elevations
+
         source_altaz = source_coord.transform_to(coord.AltAz(obstime=obs_times,
                                                              location=self.location))
         return source_altaz.alt
@@ -76,24 +131,263 @@ class Station:
 
     def is_source_visible(self, source_coord, obs_times, min_elevation):
         """Return if the source is visible for this station at the given time (with an
-        elevation larger than the entered one).
+        elevation larger than the entered one). The whole span of obs_times is checked
+        (from the analytic rise/set times), not only the sampled times.
         """
-        elevations = self.source_elevation(source_coord, obs_times)
-        return np.any(elevations >= min_elevation)
+        # Imported here as visibility depends on this module
+        from visibility import rise_set_intervals
+        obs_times = obs_times.reshape((-1,))
+        intervals = rise_set_intervals([self], source_coord, obs_times[0], obs_times[-1] - obs_times[0],
+                                       min_elevation)
+        return bool(intervals.is_visible()[0,0])
+
 
 
+    def max_elevation(self, declination):
+        """Returns the highest elevation (at culmination) that a source with the given
+        declination reaches for this station.
+        """
+        return 90*u.deg - np.abs(self.lat*u.rad - declination)
+
 
     def has_frequency(self, band):
         """Returns if the station can observe at the given band. This is
         expected to be given in wavelength (cm).
         """
-        return band in self.sefd
+        return not np.isnan(self._registry.sefd(band, self._row))
 
 
     def get_sefd(self, band):
         """Return the SEFD of the station at the given band (given in cm).
         The SEFD value is given in Jy units.
         """
-        return self.sefd[band]
+        sefd = self._registry.sefd(band, self._row)
+        if np.isnan(sefd):
+            raise KeyError(band)
+        return float(sefd)
+
+
+
+class StationArray:
+    """Registry of stations (accessed by code, like a dict of Station) stored as NumPy
+    arrays computed once at load time, and shared by all elevation, uv and sensitivity
+    computations:
+    - codes, names : lists of str
+    - xyz : geocentric (ECEF) positions in meters (N, 3)
+    - lat, lon, height : geodetic coordinates in radians and meters (N)
+    - enu : rotation matrices from ECEF to the local East, North, Up frame (N, 3, 3)
+    - wavelengths : wavelengths (str, in cm) of the SEFD columns
+    - sefds : SEFDs in Jy (N, N_wavelengths), NaN where the station cannot observe
+    - locations : EarthLocation array, so the elevation of a source can be computed for
+      many stations in a single broadcast transformation.
+    """
+    def __init__(self, codes, names, xyz, wavelengths, sefds):
+        self.codes = list(codes)
+        self.names = list(names)
+        self.xyz = np.array(xyz, dtype=float).reshape((-1, 3))
+        self.wavelengths = [str(wavelength) for wavelength in wavelengths]
+        self.sefds = np.array(sefds, dtype=float).reshape((len(self.codes), len(self.wavelengths)))
+        self.locations = coord.EarthLocation.from_geocentric(self.xyz[:,0], self.xyz[:,1], self.xyz[:,2],
+                                                             unit=u.m)
+        geodetic = self.locations.to_geodetic()
+        self.lat = geodetic.lat.rad
+        self.lon = geodetic.lon.rad
+        self.height = geodetic.height.to_value(u.m)
+        sin_lat, cos_lat = np.sin(self.lat), np.cos(self.lat)
+        sin_lon, cos_lon = np.sin(self.lon), np.cos(self.lon)
+        self.enu = np.stack([np.stack([-sin_lon, cos_lon, np.zeros_like(sin_lon)], axis=-1),
+                             np.stack([-sin_lat*cos_lon, -sin_lat*sin_lon, cos_lat], axis=-1),
+                             np.stack([cos_lat*cos_lon, cos_lat*sin_lon, sin_lat], axis=-1)], axis=1)
+        self._index = {code: i for i, code in enumerate(self.codes)}
+        self._wavelengthIndex = {wavelength: i for i, wavelength in enumerate(self.wavelengths)}
+        self.stations = {code: Station._view(self, i) for i, code in enumerate(self.codes)}
+
+    @classmethod
+    def from_file(cls, filename):
+        """Creates the array with all stations in the file, which must contain the columns
+        "station code x y z" (positions in meters) followed by "SEFD-<wavelength in cm>"
+        columns, where -1 means that the station cannot observe at that wavelength.
+        """
+        # astropy.io.ascii (and astropy.table) are slow to import, and only needed here
+        from astropy.io import ascii
+        file_with_stations = ascii.read(filename)
+        # Getting the frequencies with SEFD values
+        sefd_columns = [acol for acol in file_with_stations.colnames if 'SEFD-' in acol]
+        xyz = np.stack([np.asarray(file_with_stations[acol], dtype=float) for acol in ('x', 'y', 'z')], axis=1)
+        sefds = np.stack([np.asarray(file_with_stations[acol], dtype=float) for acol in sefd_columns], axis=1)
+        sefds[sefds == -1] = np.nan
+        return cls([str(a_code) for a_code in file_with_stations['code']],
+                   [str(a_name) for a_name in file_with_stations['station']], xyz,
+                   [acol.split('-', 1)[1] for acol in sefd_columns], sefds)
+
+    def sefd(self, wavelength, row):
+        """Returns the SEFD (Jy) of the station in the given row at the wavelength (str, cm),
+        NaN if it cannot observe at that wavelength.
+        """
+        column = self._wavelengthIndex.get(str(wavelength))
+        return np.nan if column is None else self.sefds[row, column]
+
+    def __getitem__(self, code):
+        return self.stations[code]
+
+    def __contains__(self, code):
+        return code in self.stations
+
+    def __iter__(self):
+        return iter(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def keys(self):
+        return self.stations.keys()
+
+    def values(self):
+        return self.stations.values()
+
+    def items(self):
+        return self.stations.items()
+
+    def index(self, codes=None):
+        """Returns the positions in the array of the stations with the given codes (all if None)."""
+        if codes is None:
+            return np.arange(len(self.codes))
+        return np.array([self._index[code] for code in codes], dtype=int)
+
+    def source_elevation(self, source_coord, obs_times, codes=None):
+        """Returns the elevation of the source as seen by the stations (all of them, or the
+        ones with the given codes) during obs_times, with shape (N_stations, N_times).
+        All stations are computed in a single AltAz transformation.
+        """
+        frame = coord.AltAz(obstime=obs_times.reshape((-1,))[np.newaxis,:],
+                            location=self.locations[self.index(codes)][:,np.newaxis])
+        return source_coord.transform_to(frame).alt
+
+
+def stack_locations(stations):
+    """Returns a single EarthLocation array with the positions of all given stations
+    (in the same order), so they can be broadcasted in one coordinate transformation.
+    """
+    stations = list(stations)
+    registries = {id(a_station._registry) for a_station in stations}
+    if len(registries) == 1:
+        # Taken directly from the locations of the registry
+        return stations[0]._registry.locations[[a_station._row for a_station in stations]]
+
+    xyz = np.array([a_station.xyz for a_station in stations]).reshape((-1, 3))
+    return coord.EarthLocation.from_geocentric(xyz[:,0], xyz[:,1], xyz[:,2], unit=u.m)
+
+
+def declination_limits(stations, min_elevation, margin=0.5*u.deg, min_stations=None):
+    """Returns the range of declinations (lowest, highest) of the sources that can be
+    above min_elevation at some point for all the given stations (or for at least
+    min_stations of them). Sources outside this range can never be up for enough
+    stations, whatever the time is.
+
+    With min_stations, a declination must be within the range of at least min_stations
+    stations, so it lies between the min_stations-th lowest of the lower limits and the
+    min_stations-th highest of the upper limits (the returned range may still include
+    some declinations that are not reachable by enough stations).
+
+    The margin (added on both sides) accounts for the difference between catalogue and
+    apparent declinations (precession), so no potentially visible source is rejected.
+    """
+    lats = np.degrees([a_station.lat for a_station in stations])*u.deg
+    zenith_distance = 90*u.deg - min_elevation + margin
+    n = len(stations) if min_stations is None else min(max(min_stations, 1), len(stations))
+    return max(np.sort(lats - zenith_distance)[n-1], -90*u.deg), \
+           min(np.sort(lats + zenith_distance)[::-1][n-1], 90*u.deg)
+
+
+def earth_rotation_angle(obs_times):
+    """Returns the Earth Rotation Angle (in rad) at the given times. UTC is used
+    as an approximation of UT1 (the difference is always below 0.9 s).
+    """
+    days = (obs_times.jd1 - 2451545.0) + obs_times.jd2
+    return 2*np.pi*((0.7790572732640 + 1.00273781191135448*days) % 1.0)
+
+
+def apparent_coordinates(source_coords, obs_times):
+    """Returns the apparent (CIRS) RA and Dec (in rad) of the sources at the middle of
+    obs_times. This is the only astropy transformation required by the fast path,
+    and it is done once per source instead of once per source, station and time.
+    """
+    obs_times = obs_times.reshape((-1,))
+    mid_time = obs_times[len(obs_times)//2]
+    cirs = source_coords.reshape((-1,)).transform_to(coord.CIRS(obstime=mid_time))
+    return cirs.ra.rad, cirs.dec.rad
+
+
+def fast_elevations(stations, source_coords, obs_times):
+    """Returns the elevation of many sources as seen by many stations during obs_times
+    from the geodetic latitude of each station and the hour angle of the sources,
+    in plain NumPy.
+
+    The sources are moved once to their apparent place at the middle of obs_times and
+    the hour angle is derived from the Earth Rotation Angle, ignoring polar motion,
+    UT1-UTC, diurnal aberration and refraction (as the default AltAz frame does), and
+    the change of the apparent place during obs_times. The worst-case difference with
+    the astropy path (source_elevations) is of a few arcsec (always below 0.01 deg) for
+    observations spanning up to a few days, negligible for selecting sources with
+    elevation cuts.
+
+    Inputs and output as in source_elevations.
+    """
+    ra, dec = apparent_coordinates(source_coords, obs_times)
+    return hour_angle_elevations(stations, ra, dec, obs_times)
+
+
+def hour_angle_elevations(stations, ra, dec, obs_times):
+    """Returns the elevations as fast_elevations does, from the apparent RA and Dec (in rad,
+    as returned by apparent_coordinates) of the sources.
+
+    The direction of each source in the Earth-fixed frame is computed once per time (from
+    the Earth Rotation Angle), and projected on the Up axis of the precomputed ENU frame
+    of each station (StationArray.enu), so no trigonometry is done per station.
+    """
+    obs_times = obs_times.reshape((-1,))
+    ups = np.array([a_station.enu[2] for a_station in stations]).reshape((-1, 3))
+    # Earth-fixed unit vectors of the sources with shape (N_sources, N_times, 3)
+    angle = ra[:,np.newaxis] - earth_rotation_angle(obs_times)[np.newaxis,:]
+    cos_dec = np.cos(dec)[:,np.newaxis]
+    directions = np.stack([cos_dec*np.cos(angle), cos_dec*np.sin(angle),
+                           np.broadcast_to(np.sin(dec)[:,np.newaxis], angle.shape)], axis=-1)
+    sin_el = np.einsum('stk,nk->snt', directions, ups)
+    return coord.Angle(np.degrees(np.arcsin(np.clip(sin_el, -1.0, 1.0))), unit=u.deg)
+
+
+def source_elevations(stations, source_coords, obs_times, chunk_size=500, fast=False):
+    """Returns the elevation of many sources as seen by many stations during obs_times,
+    computed in batched AltAz transformations instead of one per source and station.
+
+    Inputs
+    ------
+    - stations : list of Station
+        Stations that observe the sources.
+    - source_coords : astropy.coordinates.SkyCoord
+        Array with the coordinates of the sources (built once).
+    - obs_times : astropy.time.Time
+        Array of times to compute the elevation of the sources.
+    - chunk_size : int
+        Number of sources transformed in each batch (bounds the memory usage).
+    - fast : bool
+        If True, uses the analytic hour-angle approximation (fast_elevations).
+
+    Output
+    ------
+    - elevations : astropy.units.Quantity
+        Elevations (in deg) with shape (N_sources, N_stations, N_times).
+    """
+    if fast:
+        return fast_elevations(stations, source_coords, obs_times)
 
+    source_coords = source_coords.reshape((-1,))
+    obs_times = obs_times.reshape((-1,))
+    frame = coord.AltAz(obstime=obs_times[np.newaxis,:],
+                        location=stack_locations(stations)[:,np.newaxis])
+    elevations = np.empty((len(source_coords), len(stations), len(obs_times)))
+    for start in range(0, len(source_coords), chunk_size):
+        chunk = source_coords[start:start+chunk_size]
+        elevations[start:start+chunk_size] = chunk[:,np.newaxis,np.newaxis].transform_to(frame).alt.deg
 
+    return coord.Angle(elevations, unit=u.deg)
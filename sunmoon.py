@@ -0,0 +1,38 @@
+#Angular separation of the sources from the Sun and the Moon
+import numpy as np
+import astropy.units as u
+import astropy.coordinates as coord
+
+
+def _unit_vectors(coords):
+    xyz = coords.cartesian.xyz.value.reshape((3, -1))
+    return (xyz/np.linalg.norm(xyz, axis=0)).T
+
+
+def body_directions(body, obs_times):
+    """Returns the direction (geocentric unit vectors, shape (N_times, 3)) of the Sun or the
+    Moon (body) at the given times, computed once per time.
+    """
+    return _unit_vectors(coord.get_body(body, obs_times.reshape((-1,))))
+
+
+def body_separation(body, source_coords, obs_times):
+    """Returns the angular separation (deg) between the sources and the Sun or the Moon
+    (body) at every time, with shape (N_sources, N_times), from one matrix product of the
+    unit vectors. The aberration between the frames of the sources (ICRS) and the bodies
+    (GCRS) is ignored (about 20 arcsec), and the Moon is seen from the geocenter (up to
+    1 deg away from its position as seen by a station).
+    """
+    cos_separation = _unit_vectors(source_coords) @ body_directions(body, obs_times).T
+    return np.degrees(np.arccos(np.clip(cos_separation, -1.0, 1.0)))
+
+
+def separation_mask(source_coords, obs_times, min_sun_separation=None, min_moon_separation=None):
+    """Returns if each source is far enough from the Sun and the Moon at each time (shape
+    (N_sources, N_times)). The limits are astropy angles; no limit is applied for None.
+    """
+    allowed = np.ones((len(source_coords.reshape((-1,))), len(obs_times.reshape((-1,)))), dtype=bool)
+    for body, min_separation in (('sun', min_sun_separation), ('moon', min_moon_separation)):
+        if min_separation is not None:
+            allowed &= body_separation(body, source_coords, obs_times) >= min_separation.to_value(u.deg)
+    return allowed
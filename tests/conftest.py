@@ -0,0 +1,11 @@
+import sys
+from os import path
+
+from astropy.utils import iers
+
+# The modules live at the top level of the repository (not in a package)
+sys.path.insert(0, path.dirname(path.dirname(path.realpath(__file__))))
+
+# The tests must run offline: use the bundled IERS-B table instead of downloading IERS-A
+iers.conf.auto_download = False
+iers.conf.auto_max_age = None
@@ -0,0 +1,42 @@
+from os import path
+
+import numpy as np
+import pytest
+import astropy.units as u
+import astropy.coordinates as coord
+
+from stations import Station, fast_elevations, source_elevations
+from util_functions import get_time, get_obs_times
+
+STATIONS_FILE = path.join(path.dirname(path.dirname(path.realpath(__file__))), 'station_location.txt')
+
+
+@pytest.fixture(scope='module')
+def stations():
+    stationList = Station.stations_from_file(STATIONS_FILE)
+    # Northern, southern and equatorial stations, far apart in longitude
+    return [stationList[code] for code in ('EF', 'VLBA-MK', 'HO', 'AR', 'KM')]
+
+
+@pytest.fixture(scope='module')
+def sources():
+    ra, dec = np.meshgrid(np.arange(0.0, 360.0, 45.0), np.arange(-80.0, 90.0, 20.0))
+    return coord.SkyCoord(ra.ravel()*u.deg, dec.ravel()*u.deg)
+
+
+@pytest.mark.parametrize('start', ['01/01/2018 00:00', '15/06/2021 12:00', '30/11/2024 06:30'])
+def test_fast_elevations_worst_case(stations, sources, start):
+    """The documented worst-case difference with the astropy path is below 0.01 deg."""
+    obsTimes = get_obs_times(get_time(start), 24)
+    fast = fast_elevations(stations, sources, obsTimes).deg
+    precise = source_elevations(stations, sources, obsTimes).deg
+    assert fast.shape == precise.shape
+    assert np.max(np.abs(fast - precise)) < 0.01
+
+
+def test_station_fast_elevation(stations, sources):
+    obsTimes = get_obs_times(get_time('10/04/2021 05:00'), 12)
+    fast = stations[0].source_elevation(sources[0], obsTimes, fast=True)
+    precise = stations[0].source_elevation(sources[0], obsTimes)
+    assert fast.shape == precise.shape
+    assert np.max(np.abs((fast - precise).deg)) < 0.01
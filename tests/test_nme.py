@@ -0,0 +1,70 @@
+import json
+import time
+
+import pytest
+
+pytest.importorskip('bs4')
+pytest.importorskip('html5lib')
+
+from nme import NMEIndex
+
+
+@pytest.fixture
+def fixture_site(tmp_path):
+    """Local copy of the FTP-fringes pages: an index page linking to two NME pages
+    (and one missing page, which must be skipped)."""
+    site = tmp_path/'site'
+    (site/'ftp_fringes').mkdir(parents=True)
+    (site/'ftp_fringes'/'n21c1.html').write_text('<html><body><p>J0927+3902 4C39.25</p>'
+                                                '<p>J1800+7828 1803+784</p></body></html>')
+    (site/'ftp_fringes'/'n21c2.html').write_text('<html><body><p>J2253+1608 3C454.3 '
+                                                '1803+784</p><p>Fringes to 3C345.</p>'
+                                                '<p>Also J1800+7828.</p></body></html>')
+    (site/'ftp.html').write_text('<html><body>'
+                                 '<a href="ftp_fringes/n21c1.html">N21C1</a>'
+                                 '<a href="ftp_fringes/n21c2.html">N21C2</a>'
+                                 '<a href="ftp_fringes/missing.html">N21C3</a>'
+                                 '<a href="other.html">Other</a>'
+                                 '</body></html>')
+    return site
+
+
+def test_find_from_local_pages(fixture_site, tmp_path):
+    index = NMEIndex(filename=str(tmp_path/'index.json'), indexUrl=(fixture_site/'ftp.html').as_uri())
+    pages = [(fixture_site/'ftp_fringes'/name).as_uri() for name in ('n21c1.html', 'n21c2.html')]
+    assert index.find('J0927+3902') == pages[:1]
+    assert index.find('3C454.3') == pages[1:]
+    assert index.find('J1800+7828', '1803+784') == pages
+    # Names at the end of a sentence
+    assert index.find('3C345') == pages[1:]
+    assert index.find('J1800+7828') == pages
+    assert index.find('J0000+0000') == []
+    assert (fixture_site/'ftp_fringes'/'missing.html').as_uri() in index.pages
+
+
+def test_index_is_stored_and_refreshed(fixture_site, tmp_path):
+    filename = str(tmp_path/'index.json')
+    indexUrl = (fixture_site/'ftp.html').as_uri()
+    NMEIndex(filename=filename, indexUrl=indexUrl).find('J0927+3902')
+
+    # A new index reads the stored one instead of downloading the pages again
+    (fixture_site/'ftp_fringes'/'n21c1.html').unlink()
+    stored = NMEIndex(filename=filename, indexUrl=indexUrl)
+    assert not stored.is_stale()
+    assert len(stored.find('J0927+3902')) == 1
+
+    # Once older than the TTL, the index is rebuilt from the current pages
+    with open(filename) as fin:
+        content = json.load(fin)
+    content['created'] = time.time() - 3600
+    with open(filename, 'w') as fout:
+        json.dump(content, fout)
+    assert NMEIndex(filename=filename, indexUrl=indexUrl, ttl=60).find('J0927+3902') == []
+
+
+def test_stale_index_used_when_offline(fixture_site, tmp_path):
+    filename = str(tmp_path/'index.json')
+    indexUrl = (fixture_site/'ftp.html').as_uri()
+    NMEIndex(filename=filename, indexUrl=indexUrl).find('J0927+3902')
+    (fixture_site/'ftp.html').unlink()
+    assert len(NMEIndex(filename=filename, indexUrl=indexUrl, ttl=0).find('J0927+3902')) == 1
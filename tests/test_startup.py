@@ -0,0 +1,9 @@
+from benchmarks import import_time
+
+# Maximum time (s) to import the command-line tool (heavy optional modules must stay lazy)
+IMPORT_BUDGET = 1.0
+
+
+def test_fringeSelect_import_time():
+    # The best of a few runs, so a busy machine does not make the test fail
+    assert min(import_time('fringeSelect') for i in range(3)) < IMPORT_BUDGET
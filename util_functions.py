@@ -1,4 +1,6 @@
 #util functions for seffers
+import os
+import hashlib
 import numpy as np
 import datetime as dt
 
@@ -35,3 +37,19 @@ def get_obs_times(start_time, duration, interval=0.2):
     return start_time + np.arange(0.0, duration+interval/2., interval)*u.h
 
 
+def cache_dir():
+    """Returns the directory where seffers keeps its on-disk caches (created if needed).
+    It is $XDG_CACHE_HOME/seffers, or ~/.cache/seffers by default.
+    """
+    directory = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'seffers')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def file_hash(filename):
+    """Returns the SHA-1 hash (hex string) of the content of the file."""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
@@ -0,0 +1,75 @@
+#uv-coverage of a VLBI array for a given source
+import numpy as np
+import astropy.units as u
+
+from stations import apparent_coordinates, earth_rotation_angle, fast_elevations
+
+
+class UVCoverage:
+    """(u, v, w) tracks of all baselines of an array during an observation.
+
+    u, v and w are arrays (in meters) with shape (N_baselines, N_times), with NaN when
+    any of the two stations of the baseline is below the elevation limit. baselines is
+    the list of (code1, code2) pairs, in the same order as the rows.
+    """
+    def __init__(self, baselines, uu, vv, ww):
+        self.baselines = baselines
+        self.u = uu
+        self.v = vv
+        self.w = ww
+
+    def in_wavelengths(self, wavelength):
+        """Returns (u, v, w) in units of the given wavelength (astropy Quantity)."""
+        factor = 1.0/wavelength.to_value(u.m)
+        return self.u*factor, self.v*factor, self.w*factor
+
+    def points(self):
+        """Returns the (u, v) points (meters) of all baselines where both stations are up,
+        including the symmetric ones (-u, -v), as two flat arrays.
+        """
+        up = np.isfinite(self.u)
+        return np.concatenate([self.u[up], -self.u[up]]), np.concatenate([self.v[up], -self.v[up]])
+
+
+def baseline_pairs(n_stations):
+    """Returns the indices (i, j) with i < j of all baselines among n_stations."""
+    return np.triu_indices(n_stations, k=1)
+
+
+def uv_coverage(stations, source_coord, obs_times, min_elevation):
+    """Returns the UVCoverage of the array for the source during obs_times.
+
+    The baseline vectors (from the ECEF positions of the stations) are rotated to the
+    (u, v, w) frame of the source for all baselines and times at once, using the
+    Greenwich hour angle from the Earth Rotation Angle and the apparent position of the
+    source. Samples where any of the two stations is below min_elevation (from
+    stations.fast_elevations) are set to NaN.
+
+    Inputs
+    ------
+    - stations : list of Station
+    - source_coord : astropy.coordinates.SkyCoord
+        Coordinates of the source (single source).
+    - obs_times : astropy.time.Time
+        Array of times.
+    - min_elevation : astropy.units.Quantity
+        Elevation limit of all stations.
+    """
+    stations = list(stations)
+    obs_times = obs_times.reshape((-1,))
+    xyz = np.array([a_station.xyz for a_station in stations]).reshape((-1, 3))
+    i, j = baseline_pairs(len(stations))
+    bx, by, bz = (xyz[j] - xyz[i]).T[..., np.newaxis]
+    ra, dec = apparent_coordinates(source_coord, obs_times)
+    hour_angle = earth_rotation_angle(obs_times)[np.newaxis,:] - ra[0]
+    sin_h, cos_h = np.sin(hour_angle), np.cos(hour_angle)
+    sin_d, cos_d = np.sin(dec[0]), np.cos(dec[0])
+    uu = sin_h*bx + cos_h*by
+    vv = -sin_d*cos_h*bx + sin_d*sin_h*by + cos_d*bz
+    ww = cos_d*cos_h*bx - cos_d*sin_h*by + sin_d*bz
+    up = (fast_elevations(stations, source_coord, obs_times)[0] >= min_elevation)
+    masked = ~(up[i] & up[j])
+    for an_array in (uu, vv, ww):
+        an_array[masked] = np.nan
+
+    return UVCoverage([(stations[a].code, stations[b].code) for a, b in zip(i, j)], uu, vv, ww)
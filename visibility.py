@@ -0,0 +1,180 @@
+#Visibility windows (rise and set times) of sources for a set of stations
+import numpy as np
+import astropy.units as u
+import astropy.coordinates as coord
+
+from stations import apparent_coordinates, earth_rotation_angle, stack_locations
+
+# Rotation rate of the Earth (rad per hour of UTC).
+SIDEREAL_RATE = 2*np.pi*1.00273781191135448/24.
+
+
+class VisibilityIntervals:
+    """Intervals of time when each source is above a given elevation for each station.
+
+    The intervals are stored as two arrays (start and end, in hours since the start
+    of the observation) with shape (N_sources, N_stations, N_intervals), where NaN
+    marks the non-existing intervals.
+    """
+    def __init__(self, start_time, duration, starts, ends):
+        self.start_time = start_time
+        self.duration = duration
+        self.starts = starts
+        self.ends = ends
+
+    def is_visible(self):
+        """Returns if each source is up at some point for each station (N_sources, N_stations)."""
+        return np.any(np.isfinite(self.starts), axis=2)
+
+    def time_up(self):
+        """Returns the total time (in hours) that each source is up for each station."""
+        return np.nansum(self.ends - self.starts, axis=2)
+
+    def mask(self, obs_times):
+        """Returns if each source is up for each station at the given times, with shape
+        (N_sources, N_stations, N_times).
+        """
+        hours = (obs_times.reshape((-1,)) - self.start_time).to_value(u.h)
+        with np.errstate(invalid='ignore'):
+            return np.any((self.starts[...,np.newaxis] <= hours) & (hours <= self.ends[...,np.newaxis]),
+                          axis=2)
+
+    def times(self, source_index, station_index):
+        """Returns the list of (rise, set) astropy Times for the given source and station."""
+        return [(self.start_time + start*u.h, self.start_time + end*u.h)
+                for start, end in zip(self.starts[source_index, station_index],
+                                      self.ends[source_index, station_index]) if np.isfinite(start)]
+
+
+def longest_run(mask):
+    """Returns the length (number of consecutive True elements) of the longest run of
+    True values along the last axis of a boolean array, vectorized over the other axes.
+    """
+    index = np.arange(mask.shape[-1])
+    # Position of the last False before (or at) each element
+    last_false = np.maximum.accumulate(np.where(mask, -1, index), axis=-1)
+    return np.max(index - last_false, axis=-1, initial=0)
+
+
+def common_visibility(up, interval, min_stations=None):
+    """Returns how long each source is simultaneously up for all the stations (or for at
+    least min_stations of them).
+
+    Inputs
+    ------
+    - up : ndarray
+        Boolean array (N_sources, N_stations, N_times) telling if each source is up for
+        each station at each time of a regular grid.
+    - interval : float
+        Spacing of the time grid (in hours).
+    - min_stations : int
+        Minimum number of stations that must be up at the same time (all if None).
+
+    Outputs
+    -------
+    - fraction : ndarray
+        Fraction of the observing times when the source is commonly visible (N_sources).
+    - longest : ndarray
+        Length (hours) of the longest window of common visibility (N_sources), at the
+        resolution of the time grid (the time between its first and last samples).
+    """
+    common = np.sum(up, axis=1) >= (up.shape[1] if min_stations is None else min_stations)
+    return np.mean(common, axis=1), np.maximum(longest_run(common) - 1, 0)*interval
+
+
+def crossing_hour_angle(latitude, declination, min_elevation):
+    """Returns the hour angle (rad, between 0 and pi) at which a source at the given
+    declination crosses min_elevation for a station at the given latitude (all in rad).
+    The source is above min_elevation while |hour angle| <= the returned value.
+    It is NaN if the source never reaches min_elevation, and pi if it is always above it.
+    """
+    cos_h = (np.sin(min_elevation) - np.sin(latitude)*np.sin(declination)) \
+            / (np.cos(latitude)*np.cos(declination))
+    return np.where(cos_h > 1.0, np.nan, np.arccos(np.clip(cos_h, -1.0, 1.0)))
+
+
+def rise_set_intervals(stations, source_coords, start_time, duration, min_elevation, refine=False):
+    """Returns the exact intervals when the sources are above min_elevation for each station
+    during the observation, as a VisibilityIntervals object.
+
+    The rise and set times are derived analytically from the crossing hour angle, using
+    the apparent place of the sources and the Earth Rotation Angle as in
+    stations.fast_elevations (a few arcsec of accuracy). If refine, every rise or set
+    time within the observation is then refined with Newton iterations on the elevations
+    from the full astropy AltAz transformation (all crossings at once).
+
+    Inputs
+    ------
+    - stations : list of Station
+    - source_coords : astropy.coordinates.SkyCoord
+        Coordinates of the sources (either single source or an array).
+    - start_time : astropy.time.Time
+        Start of the observation.
+    - duration : astropy.units.Quantity
+        Duration of the observation.
+    - min_elevation : astropy.units.Quantity
+        Elevation limit.
+    - refine : bool
+        Refines the rise/set times with the astropy elevations.
+    """
+    duration = duration.to_value(u.h)
+    source_coords = source_coords.reshape((-1,))
+    ra, dec = apparent_coordinates(source_coords, start_time + np.array([0.0, duration])*u.h)
+    lons = np.array([a_station.lon for a_station in stations])
+    lats = np.array([a_station.lat for a_station in stations])
+    h0 = crossing_hour_angle(lats[np.newaxis,:], dec[:,np.newaxis], min_elevation.to_value(u.rad))
+    # Hour angle at the start of the observation, within (-pi, pi]
+    ha_start = earth_rotation_angle(start_time) + lons[np.newaxis,:] - ra[:,np.newaxis]
+    ha_start = np.pi - (np.pi - ha_start) % (2*np.pi)
+    # Candidate transits (k-th after the previous one) that can overlap with the observation
+    k = np.arange(int(np.ceil(duration*SIDEREAL_RATE/(2*np.pi))) + 2)
+    transits = (2*np.pi*k[np.newaxis,np.newaxis,:] - ha_start[...,np.newaxis])/SIDEREAL_RATE
+    half_window = (h0/SIDEREAL_RATE)[...,np.newaxis]
+    with np.errstate(invalid='ignore'):
+        starts = np.clip(transits - half_window, 0.0, duration)
+        ends = np.clip(transits + half_window, 0.0, duration)
+        # Zero-length intervals are only kept for a zero-length observation (a single time)
+        overlaps = (transits + half_window >= 0.0) & (transits - half_window <= duration)
+        empty = ~(overlaps & ((ends > starts) | (duration == 0.0)))
+    # Sources always up: a single interval covering the whole observation
+    always = np.broadcast_to((h0 >= np.pi)[...,np.newaxis], starts.shape)
+    starts[always], ends[always] = np.nan, np.nan
+    starts[...,0][always[...,0]], ends[...,0][always[...,0]] = 0.0, duration
+    empty &= ~always
+    starts[empty], ends[empty] = np.nan, np.nan
+    if refine and (duration > 0.0):
+        _refine_crossings(stations, source_coords, start_time, duration, min_elevation, starts, ra, dec)
+        _refine_crossings(stations, source_coords, start_time, duration, min_elevation, ends, ra, dec)
+        vanished = ~(ends > starts)
+        starts[vanished], ends[vanished] = np.nan, np.nan
+
+    return VisibilityIntervals(start_time, duration*u.h, starts, ends)
+
+
+def _refine_crossings(stations, source_coords, start_time, duration, min_elevation, crossings, ra, dec,
+                      iterations=2, max_step=0.05):
+    """Refines (in place) the crossing times (hours) strictly inside the observation with
+    Newton iterations on the elevations from the full astropy AltAz transformation (one
+    transformation for all crossings per iteration). The elevation rate comes from the
+    analytic model, and each step is limited to max_step hours.
+    """
+    inside = np.isfinite(crossings) & (crossings > 0.0) & (crossings < duration)
+    i_source, i_station, _ = np.nonzero(inside)
+    if len(i_source) == 0:
+        return
+
+    locations = stack_locations(stations)[i_station]
+    lats = np.array([a_station.lat for a_station in stations])[i_station]
+    lons = np.array([a_station.lon for a_station in stations])[i_station]
+    coords = source_coords[i_source]
+    hours = crossings[inside]
+    for _ in range(iterations):
+        times = start_time + hours*u.h
+        elevation = coords.transform_to(coord.AltAz(obstime=times, location=locations)).alt.rad
+        hour_angle = earth_rotation_angle(times) + lons - ra[i_source]
+        rate = -SIDEREAL_RATE*np.cos(lats)*np.cos(dec[i_source])*np.sin(hour_angle)/np.cos(elevation)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = np.where(np.abs(rate) > 1e-6, -(elevation - min_elevation.to_value(u.rad))/rate, 0.0)
+        hours = np.clip(hours + np.clip(step, -max_step, max_step), 0.0, duration)
+
+    crossings[inside] = hours